@@ -0,0 +1,182 @@
+"""Clipstorm render benchmark: synthetic inputs, a headless batch, throughput and baselines.
+
+Hooks, voiceovers and bodies are generated locally with ffmpeg's lavfi sources (testsrc and a
+sine tone padded with leading and trailing silence), then rendered with the same render_batch
+the app and CLI use, without and/or with captions:
+
+    python clipstorm_bench.py --hooks 3 --voices 2 --bodies 2 --captions both
+    python clipstorm_bench.py --hooks 10 --voices 4 --hook-seconds 12 --save-baseline
+    python clipstorm_bench.py --whisper tiny --captions on
+    python clipstorm_bench.py --profile 9x16 --profile 1x1 --profile 16x9
+
+Each scenario starts from an empty intermediate cache (unless --warm) and reports end-to-end
+outputs per minute, the realtime factor (seconds of video produced per second of wall time)
+and per-stage totals from the run's metrics.jsonl. With a baseline file present, results are
+compared against it and a throughput drop beyond --tolerance exits non-zero; --repeat keeps
+the fastest of several runs to damp noise.
+"""
+import os, shutil, sys
+from pathlib import Path
+import argparse
+import json
+import time
+
+from clipstorm_engine import (
+    IntermediateCache, StageLog, Transcriber, ff, load_inputs, prober, render_batch, summarize_stages, timed_stage,
+)
+
+class StubTranscriber(Transcriber):
+    """Transcriber that skips Whisper and writes evenly spaced placeholder segments."""
+
+    def __init__(self, cache, line_seconds=1.2):
+        super().__init__(cache, model_name="stub")
+        self.line_seconds = line_seconds
+
+    def _transcribe(self, audio: Path, start, dur, dest: Path):
+        with timed_stage("transcribe"):
+            segments, t = [], 0.0
+            while t < dur:
+                segments.append({"start": t, "end": min(t + self.line_seconds, dur), "text": f" Line {len(segments) + 1}"})
+                t += self.line_seconds
+            dest.write_text(json.dumps(segments))
+
+def generate_media(media: Path, args):
+    """Write the synthetic inputs (reused if already there for the same settings); returns (hooks, voices, bodies)."""
+    media.mkdir(parents=True, exist_ok=True)
+    lead, tail = args.silence
+    encode = ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-ar", "44100", "-ac", "2"]
+
+    def make(name, cmd):
+        dest = media / name
+        if not dest.exists():
+            ff(["ffmpeg", "-y", *cmd, str(dest)], "generate")
+        return dest
+
+    hooks = [make(f"hook_{i + 1}_{args.hook_size}_{args.hook_fps}fps_{args.hook_seconds}s.mp4", [
+        "-f", "lavfi", "-i", f"testsrc=size={args.hook_size}:rate={args.hook_fps}:duration={args.hook_seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency={220 + 40 * i}:duration={args.hook_seconds}:sample_rate=48000",
+        # A different hue per hook so every input has its own content (and cache keys)
+        "-vf", f"hue=h={37 * i}", *encode, "-shortest",
+    ]) for i in range(args.hooks)]
+    voices = [make(f"voice_{i + 1}_{lead}+{args.voice_seconds}+{tail}s.wav", [
+        "-f", "lavfi", "-i", f"sine=frequency={330 + 55 * i}:duration={args.voice_seconds}:sample_rate=44100",
+        "-af", f"adelay={int(lead * 1000)}:all=1,apad=pad_dur={tail}", "-ac", "2",
+    ]) for i in range(args.voices)]
+    bodies = [make(f"body_{i + 1}_{args.body_size}_{args.body_seconds}s.mp4", [
+        "-f", "lavfi", "-i", f"testsrc2=size={args.body_size}:rate=30:duration={args.body_seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency={440 + 40 * i}:duration={args.body_seconds}:sample_rate=44100",
+        "-vf", f"hue=h={53 * i}", *encode, "-shortest",
+    ]) for i in range(args.bodies)]
+    return hooks, voices, bodies
+
+def scenario_key(args, captions):
+    pipeline = ("chained" if args.chained else "single_pass") + ("" if args.stream_copy else "+no_stream_copy")
+    return (f"{args.hooks}h{args.voices}v{args.bodies}b"
+            f"_hook{args.hook_size}@{args.hook_fps}x{args.hook_seconds}s_voice{args.voice_seconds}s_body{args.body_size}x{args.body_seconds}s"
+            f"_{pipeline}_j{args.jobs}t{args.threads}" + (f"_captions-{args.whisper}" if captions else "")
+            + (f"_profiles-{'+'.join(args.profile)}" if args.profile else "")
+            + ("_warm" if args.warm else ""))
+
+def run_scenario(args, work: Path, inputs, captions):
+    cache_root = work / "cache"
+    if not args.warm:
+        shutil.rmtree(cache_root, ignore_errors=True)
+    cache = IntermediateCache(cache_root, 100 * 1024**3)
+    transcriber = None
+    if captions:
+        transcriber = StubTranscriber(cache) if args.whisper == "stub" else Transcriber(cache, args.whisper)
+
+    started = time.perf_counter()
+    hooks = load_inputs(inputs[0])
+    voices = load_inputs(inputs[1], trim=True)
+    bodies = load_inputs(inputs[2])
+    ingest = time.perf_counter() - started
+
+    started = time.perf_counter()
+    out, results = render_batch(hooks, voices, bodies, "bench", captions, work / "rendered", not args.chained,
+                                args.jobs, args.threads, cache, transcriber, stream_copy=args.stream_copy, profiles=args.profile or None)
+    wall = time.perf_counter() - started
+    errors = [e for r in results for e in r["errors"]]
+    outputs = [Path(p) for r in results for p in r["outputs"]]
+    media_seconds = sum(prober.probe(p)["duration"] for p in outputs)
+    totals, _ = summarize_stages(StageLog.load(out))
+    if not args.keep:
+        shutil.rmtree(out, ignore_errors=True)
+    return {
+        "outputs": len(outputs), "errors": errors, "ingest_s": ingest, "render_s": wall,
+        "outputs_per_minute": len(outputs) / wall * 60 if wall else 0.0,
+        "realtime_factor": media_seconds / wall if wall else 0.0,
+        "stages": {t["stage"]: {"runs": t["runs"], "wall": t["wall"], "cpu": t["cpu"]} for t in totals},
+    }
+
+def report(key, result, baseline, tolerance):
+    """Print one scenario's numbers next to its baseline; returns True if throughput regressed."""
+    def delta(now, then):
+        return f" ({(now - then) / then:+.0%} vs baseline)" if then else ""
+
+    base = baseline or {}
+    print(f"\n{key}")
+    print(f"  {result['outputs']} outputs in {result['render_s']:.1f}s (+{result['ingest_s']:.1f}s ingest)"
+          + (f", {len(result['errors'])} errors" if result["errors"] else ""))
+    print(f"  {result['outputs_per_minute']:.1f} outputs/min{delta(result['outputs_per_minute'], base.get('outputs_per_minute'))}")
+    print(f"  {result['realtime_factor']:.2f}x realtime{delta(result['realtime_factor'], base.get('realtime_factor'))}")
+    for stage, t in sorted(result["stages"].items(), key=lambda item: item[1]["wall"], reverse=True):
+        then = base.get("stages", {}).get(stage, {}).get("wall")
+        print(f"    {stage:<12} {t['runs']:>4} runs  {t['wall']:8.2f}s wall  {t['cpu']:8.2f}s cpu{delta(t['wall'], then)}")
+    for e in result["errors"]:
+        print(f"  Error: {e}", file=sys.stderr)
+    regressed = bool(baseline) and result["outputs_per_minute"] < baseline["outputs_per_minute"] * (1 - tolerance)
+    if regressed:
+        print(f"  REGRESSION: throughput is more than {tolerance:.0%} below baseline", file=sys.stderr)
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Clipstorm render pipeline on synthetic media.")
+    parser.add_argument("--hooks", type=int, default=2)
+    parser.add_argument("--voices", type=int, default=2)
+    parser.add_argument("--bodies", type=int, default=1)
+    parser.add_argument("--hook-seconds", type=float, default=6.0)
+    parser.add_argument("--voice-seconds", type=float, default=3.0, help="length of the tone, before silence padding")
+    parser.add_argument("--body-seconds", type=float, default=5.0)
+    parser.add_argument("--silence", type=lambda s: tuple(float(x) for x in s.split(",")), default=(0.7, 0.5),
+                        metavar="LEAD,TAIL", help="seconds of silence before and after each voice (default: 0.7,0.5)")
+    parser.add_argument("--hook-size", default="720x1280")
+    parser.add_argument("--hook-fps", type=int, default=25)
+    parser.add_argument("--body-size", default="1080x1920")
+    parser.add_argument("--captions", choices=["off", "on", "both"], default="off")
+    parser.add_argument("--whisper", default="stub", help='"stub" for placeholder captions, or a Whisper model name such as tiny')
+    cpu_count = os.cpu_count() or 1
+    parser.add_argument("--threads", type=int, default=min(2, cpu_count), help="libx264 threads per render")
+    parser.add_argument("--jobs", type=int, default=None, help="parallel renders (default: cores / threads)")
+    parser.add_argument("--chained", action="store_true", help="use the legacy one-encode-per-step pipeline")
+    parser.add_argument("--no-stream-copy", dest="stream_copy", action="store_false")
+    parser.add_argument("--profile", action="append", default=[], help="output profile to render (repeatable, default: 9x16)")
+    parser.add_argument("--warm", action="store_true", help="keep the intermediate cache between scenarios and invocations")
+    parser.add_argument("--work", type=Path, default=Path(".clipstorm_bench"), help="generated media, cache and renders (default: .clipstorm_bench)")
+    parser.add_argument("--keep", action="store_true", help="keep the rendered videos")
+    parser.add_argument("--baseline", type=Path, default=Path("clipstorm_bench_baselines.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="record these results as the baseline for their scenarios")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop before flagging a regression (default: 0.2)")
+    parser.add_argument("--repeat", type=int, default=1, help="run each scenario N times and keep the fastest, to damp noise")
+    args = parser.parse_args(argv)
+    args.jobs = args.jobs or max(1, cpu_count // args.threads)
+
+    inputs = generate_media(args.work / "media", args)
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    regressed = failed = False
+    for captions in {"off": [False], "on": [True], "both": [False, True]}[args.captions]:
+        key = scenario_key(args, captions)
+        runs = [run_scenario(args, args.work, inputs, captions) for _ in range(max(1, args.repeat))]
+        result = max(runs, key=lambda r: r["outputs_per_minute"])
+        result["errors"] = [e for r in runs for e in r["errors"]]
+        regressed |= report(key, result, baselines.get(key), args.tolerance)
+        failed |= bool(result["errors"])
+        if args.save_baseline and not result["errors"]:
+            baselines[key] = {k: v for k, v in result.items() if k != "errors"}
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"\nBaselines saved to {args.baseline}")
+    return 1 if regressed or failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
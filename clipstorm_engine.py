@@ -0,0 +1,1604 @@
+"""Clipstorm render engine: everything needed to turn hooks, voiceovers and bodies into videos.
+
+The Streamlit app (clipstorm_streamlit.py) drives this module, and so can a headless render box:
+
+    python clipstorm_engine.py manifest.json --jobs 4 --threads 2 --nice 10
+    python clipstorm_engine.py --resume rendered_videos/<run>
+    python clipstorm_engine.py manifest.json --draft
+    python clipstorm_engine.py --from-draft rendered_videos/<draft run> --select <file> --profile 9x16 --profile 1x1
+
+A manifest is either JSON (one batch object, or a list of them) with "prefix", "captions",
+"hooks", "voices" and optional "bodies" and "profiles" keys, or a CSV with prefix,captions,kind,path columns
+where kind is hook, voice or body and rows sharing prefix and captions form one batch.
+Relative paths are resolved against the manifest's directory.
+"""
+import os, shutil, subprocess, tempfile, threading, sys
+import contextlib
+import itertools
+import contextvars
+import resource
+import signal
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+import argparse
+import csv
+import json
+import re
+import hashlib
+import time
+import uuid
+
+video_exts = {".mp4", ".mov"}
+audio_exts = {".wav", ".mp3", ".m4a"}
+
+def sanitize_filename(name):
+    # Replace spaces and apostrophes with underscores, remove non-ASCII
+    name = re.sub(r"[’'\"\\s]", "_", name)
+    name = re.sub(r"[^a-zA-Z0-9._-]", "", name)
+    return name
+
+def detect_silence_endpoints(fp: Path, min_silence_len=100, pad=50, chunk_ms=10_000):
+    """Return (start, end) in seconds of fp with leading and trailing silence removed.
+
+    Matches the old pydub trim (threshold audio.dBFS - 20, 100 ms windows, 50 ms padding) but
+    streams 16-bit PCM from an ffmpeg pipe and only keeps one energy value per millisecond,
+    so long voiceovers are never fully decoded into memory or re-exported as WAV.
+    """
+    rate, channels = 48000, 2  # 48 samples per ms; upmixing mono leaves its RMS unchanged
+    frame = rate // 1000 * channels
+    proc = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-i", str(fp), "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(rate), "-ac", str(channels), "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    energy = []
+    leftover = np.empty(0, dtype=np.int16)
+    while True:
+        data = proc.stdout.read(chunk_ms * frame * 2)
+        if not data:
+            break
+        samples = np.concatenate([leftover, np.frombuffer(data, dtype=np.int16)])
+        whole = len(samples) // frame * frame
+        leftover = samples[whole:]
+        # Sum of squares per millisecond, across both channels
+        energy.append(np.square(samples[:whole].astype(np.float64)).reshape(-1, frame).sum(axis=1))
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    energy = np.concatenate(energy) if energy else np.empty(0)
+    length = len(energy)
+    full = (0.0, length / 1000)
+    if length < min_silence_len or not energy.any():
+        return full
+
+    # A window is silent when its RMS is at least 20 dB below the whole file's RMS, i.e. a hundredth of the power
+    threshold = energy.sum() / length * 0.01
+    cumulative = np.concatenate([[0.0], np.cumsum(energy)])
+    window_energy = cumulative[min_silence_len:] - cumulative[:-min_silence_len]
+    silent_starts = np.flatnonzero(window_energy <= threshold * min_silence_len)
+    if len(silent_starts) == 0:
+        return full
+    # pydub merges silent windows whose starts are within min_silence_len of each other into one range
+    breaks = np.flatnonzero(np.diff(silent_starts) > min_silence_len)
+    first_end = silent_starts[breaks[0] if len(breaks) else -1] + min_silence_len
+    last_start = silent_starts[breaks[-1] + 1 if len(breaks) else 0]
+    start = first_end if silent_starts[0] == 0 else 0
+    end = last_start if silent_starts[-1] == length - min_silence_len else length
+    if start >= end:
+        # Everything is silence; keep the clip as-is
+        return full
+    return float(max(start - pad, 0)) / 1000, float(min(end + pad, length)) / 1000
+
+def trim_args(start, dur):
+    return ["-ss", f"{start:.3f}", "-t", f"{dur:.3f}"]
+
+def voice_input(v_path: Path, start, dur):
+    # The silence trim is applied on the input side, so no trimmed WAV is ever written
+    return [*trim_args(start, dur), "-i", str(v_path)]
+
+def parse_rate(rate):
+    # ffprobe reports frame rates and time bases as fractions like "30000/1001"
+    try:
+        num, den = (float(x) for x in str(rate).split("/")) if "/" in str(rate) else (float(rate), 1.0)
+        return num / den if den else 0.0
+    except ValueError:
+        return 0.0
+
+def summarize_probe(info):
+    """Flatten ffprobe's -show_format -show_streams JSON into the fields the pipeline plans with."""
+    fmt = info.get("format", {})
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    duration = float(fmt.get("duration") or 0.0)
+    record = {"duration": duration, "format": fmt.get("format_name"), "size": int(fmt.get("size") or 0),
+              "video": None, "audio": None}
+    if video:
+        record["video"] = {
+            "codec": video.get("codec_name"), "profile": video.get("profile"),
+            "width": video.get("width"), "height": video.get("height"),
+            "fps": parse_rate(video.get("avg_frame_rate") or video.get("r_frame_rate")),
+            "pix_fmt": video.get("pix_fmt"), "time_base": video.get("time_base"),
+            "level": video.get("level"), "extradata": video.get("extradata_hash"),
+        }
+    if audio:
+        record["audio"] = {
+            "codec": audio.get("codec_name"), "profile": audio.get("profile"), "sample_rate": int(audio.get("sample_rate") or 0),
+            "channels": audio.get("channels"), "channel_layout": audio.get("channel_layout"),
+        }
+    return record
+
+class MediaProber:
+    """Runs one ffprobe per file and remembers the result by (path, size, mtime)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def probe(self, fp: Path):
+        fp = Path(fp)
+        info = fp.stat()
+        key = (str(fp.resolve()), info.st_size, info.st_mtime_ns)
+        with self._lock:
+            if key in self._records:
+                return self._records[key]
+        # The extradata hash (SPS/PPS for H.264) tells whether two streams can be joined without re-encoding
+        r = subprocess.run(["ffprobe", "-v", "error", "-show_format", "-show_streams", "-show_data_hash", "sha256", "-of", "json", str(fp)],
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        record = summarize_probe(json.loads(r.stdout or b"{}"))
+        with self._lock:
+            self._records[key] = record
+        return record
+
+    def starts_on_keyframe(self, fp: Path):
+        """True if the first video packet is a keyframe, so the file can be cut from 0 without re-encoding."""
+        fp = Path(fp)
+        info = fp.stat()
+        key = ("keyframe", str(fp.resolve()), info.st_size, info.st_mtime_ns)
+        with self._lock:
+            if key in self._records:
+                return self._records[key]
+        r = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-read_intervals", "%+#1",
+                            "-show_entries", "packet=flags", "-of", "csv=p=0", str(fp)],
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        keyframe = r.stdout.decode().startswith("K")
+        with self._lock:
+            self._records[key] = keyframe
+        return keyframe
+
+    def probe_many(self, paths, max_workers=8):
+        """Probe several files concurrently; returns records in the order given."""
+        paths = list(paths)
+        if not paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+            return list(pool.map(self.probe, paths))
+
+# One prober per process; imported modules survive Streamlit reruns, so the app shares it too
+prober = MediaProber()
+
+def get_duration(fp: Path):
+    return prober.probe(fp)["duration"]
+
+class StageLog:
+    """Per-run record of every pipeline stage, one JSON line each in the run folder's metrics.jsonl.
+
+    Each line has the stage type, the output it ran for, wall and CPU seconds, peak RSS, input
+    and output bytes and (for ffmpeg) its final -progress speed. Resumed runs append to it.
+    """
+
+    file_name = "metrics.jsonl"
+
+    def __init__(self, out: Path):
+        self.path = Path(out) / self.file_name
+        self._lock = threading.Lock()
+
+    def record(self, stage, **fields):
+        line = {"stage": stage, "output": current_output.get(), "time": time.time(), **fields}
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(line) + "\n")
+
+    @classmethod
+    def load(cls, out: Path):
+        path = Path(out) / cls.file_name
+        if not path.exists():
+            return []
+        with open(path) as f:
+            return [json.loads(raw) for raw in f if raw.strip()]
+
+# Set by Batch.render for each job's thread (and carried into the transcriber's), so ff() knows
+# where to log and which batch's cancellation applies
+stage_log = contextvars.ContextVar("stage_log", default=None)
+current_output = contextvars.ContextVar("current_output", default=None)
+current_batch = contextvars.ContextVar("current_batch", default=None)
+
+def file_bytes(fp):
+    try:
+        return os.path.getsize(fp)
+    except (OSError, TypeError):
+        return 0
+
+class RenderCancelled(Exception):
+    """The batch a stage belongs to was cancelled; raised instead of starting (or finishing) ffmpeg."""
+
+class FFmpegError(subprocess.CalledProcessError):
+    """An ffmpeg run that exited non-zero; str() ends with the last lines ffmpeg wrote to stderr."""
+
+    def __str__(self):
+        tail = (self.stderr or "").strip().splitlines()[-8:]
+        return "\n".join([super().__str__(), *tail])
+
+def ff(cmd, stage="ffmpeg", outputs=None):
+    """Run an ffmpeg command, raising FFmpegError with its stderr on failure, and log it as one stage.
+
+    outputs lists the files it writes, for commands with more than the last argument as output.
+    """
+    # Machine-readable progress on stdout; the last speed= line is the stage's average speed
+    cmd = [cmd[0], "-hide_banner", "-nostdin", "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    in_bytes = sum(file_bytes(cmd[i + 1]) for i, a in enumerate(cmd[:-1]) if a == "-i")
+    batch = current_batch.get()
+    if batch is not None and batch.cancelled.is_set():
+        raise RenderCancelled(stage)
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if batch is not None:
+        # So Batch.cancel() can stop it mid-encode
+        batch.track(proc)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    speed = None
+    for line in proc.stdout:
+        if line.startswith(b"speed=") and line.strip().endswith(b"x"):
+            speed = float(line.strip()[6:-1] or 0)
+    if batch is not None:
+        # ffmpeg closes stdout as it exits; untracked before it's reaped, so cancel() never signals a reused pid
+        batch.untrack(proc)
+    # wait4 instead of wait() so the child's own CPU time and peak RSS come back with its exit status
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    reader.join()
+    proc.stdout.close()
+    proc.stderr.close()
+    log = stage_log.get()
+    if log is not None:
+        log.record(stage, wall=time.perf_counter() - started, cpu=usage.ru_utime + usage.ru_stime,
+                   # ru_maxrss is kilobytes on Linux and bytes on macOS
+                   max_rss=usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+                   in_bytes=in_bytes, out_bytes=sum(file_bytes(p) for p in outputs or [cmd[-1]]), speed=speed, returncode=proc.returncode)
+    if proc.returncode and batch is not None and batch.cancelled.is_set():
+        raise RenderCancelled(stage)
+    if proc.returncode:
+        raise FFmpegError(proc.returncode, cmd, stderr=stderr[0].decode(errors="replace") if stderr else "")
+
+class timed_stage:
+    """Log an in-process stage (e.g. Whisper) the way ff() logs an ffmpeg run."""
+
+    def __init__(self, stage, in_bytes=0):
+        self.stage, self.in_bytes = stage, in_bytes
+
+    def __enter__(self):
+        self.started, self.cpu = time.perf_counter(), time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        log = stage_log.get()
+        if log is not None:
+            # Peak RSS of the whole app process, which is what a model load shows up in
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            log.record(self.stage, wall=time.perf_counter() - self.started, cpu=time.thread_time() - self.cpu,
+                       max_rss=max_rss, in_bytes=self.in_bytes, out_bytes=0, speed=None, returncode=1 if exc[0] else 0)
+        return False
+
+def summarize_stages(records, slowest=10):
+    """(totals per stage type, the slowest single stage runs) from StageLog records."""
+    totals = {}
+    for r in records:
+        t = totals.setdefault(r["stage"], {"stage": r["stage"], "runs": 0, "wall": 0.0, "cpu": 0.0, "max_rss_mb": 0.0,
+                                           "in_mb": 0.0, "out_mb": 0.0, "speeds": []})
+        t["runs"] += 1
+        t["wall"] += r["wall"]
+        t["cpu"] += r["cpu"]
+        t["max_rss_mb"] = max(t["max_rss_mb"], r["max_rss"] / 1024**2)
+        t["in_mb"] += r["in_bytes"] / 1024**2
+        t["out_mb"] += r["out_bytes"] / 1024**2
+        if r.get("speed"):
+            t["speeds"].append(r["speed"])
+    for t in totals.values():
+        speeds = t.pop("speeds")
+        t["avg_speed"] = sum(speeds) / len(speeds) if speeds else None
+    top = sorted(records, key=lambda r: r["wall"], reverse=True)[:slowest]
+    return sorted(totals.values(), key=lambda t: t["wall"], reverse=True), top
+
+def write_srt(segments, out_path):
+    def format_srt_time(seconds):
+        h = int(seconds // 3600)
+        m = int((seconds % 3600) // 60)
+        s = int(seconds % 60)
+        ms = int((seconds - int(seconds)) * 1000)
+        return f"{h:02}:{m:02}:{s:02},{ms:03}"
+    with open(out_path, "w") as f:
+        for i, seg in enumerate(segments):
+            start = seg['start']
+            end = seg['end']
+            text = seg['text'].strip()
+            # Remove trailing period
+            if text.endswith('.'):
+                text = text[:-1]
+            f.write(f"{i+1}\n")
+            f.write(f"{format_srt_time(start)} --> {format_srt_time(end)}\n")
+            f.write(f"{text}\n\n")
+
+def get_video_height(fp: Path):
+    video = prober.probe(fp)["video"]
+    return video["height"] if video and video["height"] else 720
+
+# Standardize video/audio properties for concat compatibility
+standard_args = ["-vf", "scale=1080:1920", "-r", "30", "-ar", "44100", "-ac", "2"]
+
+def x264_args(threads=None, preset="veryfast"):
+    # Cap libx264's thread pool so parallel renders share the cores instead of oversubscribing them.
+    # Cache keys are built without threads, since the thread count doesn't change what gets encoded.
+    args = ["-c:v", "libx264", "-preset", preset, "-c:a", "aac"]
+    return args if threads is None else args + ["-threads", str(threads)]
+
+class IntermediateCache:
+    """Content-addressed on-disk store for ffmpeg intermediates, shared across runs and sessions.
+
+    Entries are keyed by the digests of their input files plus the ffmpeg arguments that
+    produced them, and evicted least-recently-used once the store grows past max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        # Absolute, because entry paths end up in concat lists that ffmpeg resolves relative to the list
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._digests = {}
+
+    @staticmethod
+    def _identity(fp: Path):
+        info = fp.stat()
+        return (str(fp.resolve()), info.st_size, info.st_mtime_ns)
+
+    def digest(self, fp: Path):
+        # A cache entry is named after its key, which already identifies its content
+        if fp.parent.parent == self.root:
+            return fp.name.split(".", 1)[0]
+        # Hash each input once per (path, size, mtime); multi-GB hooks are only read again if they change
+        ident = self._identity(fp)
+        with self._lock:
+            if ident in self._digests:
+                return self._digests[ident]
+        h = hashlib.sha256()
+        with open(fp, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        with self._lock:
+            self._digests[ident] = h.hexdigest()
+        return self._digests[ident]
+
+    def fetch(self, inputs, args, build, suffix=".mp4"):
+        """Return the cached file for (inputs, args), calling build(dest) to create it on a miss."""
+        key = hashlib.sha256(json.dumps([[self.digest(Path(p)) for p in inputs], [str(a) for a in args]]).encode()).hexdigest()
+        path = self.root / key[:2] / f"{key}{suffix}"
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Concurrent jobs asking for the same entry wait for one build instead of encoding it twice
+        with key_lock:
+            if path.exists():
+                # Eviction is ordered by atime, so touch it explicitly (filesystems are often mounted noatime)
+                os.utime(path, (time.time(), path.stat().st_mtime))
+                with self._lock:
+                    self.hits += 1
+                return path
+            with self._lock:
+                self.misses += 1
+            path.parent.mkdir(exist_ok=True)
+            partial = path.with_name(f"{key}.partial{suffix}")
+            try:
+                build(partial)
+                os.replace(partial, path)
+            finally:
+                partial.unlink(missing_ok=True)
+        self._evict(keep=path)
+        return path
+
+    def _entries(self):
+        return [p for p in self.root.glob("*/*") if ".partial" not in p.name]
+
+    def _evict(self, keep: Path):
+        entries = []
+        for p in self._entries():
+            try:
+                info = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_atime, info.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            p.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self):
+        sizes = []
+        for p in self._entries():
+            try:
+                sizes.append(p.stat().st_size)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(sizes), "bytes": sum(sizes)}
+
+def default_cache():
+    root = Path(os.environ.get("CLIPSTORM_CACHE_DIR", ".clipstorm_cache"))
+    max_gb = float(os.environ.get("CLIPSTORM_CACHE_MAX_GB", "20"))
+    return IntermediateCache(root, int(max_gb * 1024**3))
+
+class Scratch:
+    """One job's scratch directory, handed out by Workspace.scratch() and removed when the job ends."""
+
+    def __init__(self, workspace, name):
+        self.workspace = workspace
+        self.name = name
+        self.dir = None
+
+    def path(self, file_name):
+        """Where to write file_name, in this job's directory under the workspace root."""
+        if self.dir is None:
+            self.dir = self.workspace.root / self.name
+            self.dir.mkdir(parents=True, exist_ok=True)
+        return self.dir / file_name
+
+class Workspace:
+    """Scratch space for renders under one disk root.
+
+    Intermediates worth keeping live in the IntermediateCache; a job's scratch directory only holds
+    what's specific to it (concat lists, the chained pipeline's source for other profiles) and is
+    removed when the job ends. Those left behind by a process that died are swept on startup.
+    Run folders under an output root are kept within output_max_bytes by prune_runs.
+    """
+
+    # Job dirs are named <pid>-<12 hex digits>, see scratch()
+    job_dir = re.compile(r"(\d+)-[0-9a-f]{12}")
+
+    def __init__(self, root: Path, output_max_bytes=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.output_max_bytes = output_max_bytes
+        self._sweep()
+
+    def _sweep(self):
+        # Only job dirs of processes that are gone are removed; anything else under root is left alone
+        for d in self.root.iterdir():
+            match = self.job_dir.fullmatch(d.name)
+            if not match or not d.is_dir():
+                continue
+            try:
+                os.kill(int(match.group(1)), 0)
+            except ProcessLookupError:
+                shutil.rmtree(d, ignore_errors=True)
+            except PermissionError:
+                pass
+
+    @contextlib.contextmanager
+    def scratch(self):
+        scratch = Scratch(self, f"{os.getpid()}-{uuid.uuid4().hex[:12]}")
+        try:
+            yield scratch
+        finally:
+            if scratch.dir is not None:
+                shutil.rmtree(scratch.dir, ignore_errors=True)
+
+    def prune_runs(self, out_root: Path, keep=()):
+        """Delete the least recently used run folders under out_root until the rest fit in output_max_bytes.
+
+        Only run folders (those with a JobJournal) count and are deleted; anything else under out_root is
+        left alone. Folders in keep (e.g. runs that are rendering) are never deleted. Returns the deleted folders.
+        """
+        out_root = Path(out_root)
+        if not self.output_max_bytes or not out_root.is_dir():
+            return []
+        keep = {Path(k).resolve() for k in keep}
+        runs = []
+        for d in out_root.iterdir():
+            if not (d / JobJournal.file_name).is_file():
+                continue
+            size, last_used = 0, d.stat().st_mtime
+            for p in d.rglob("*"):
+                try:
+                    info = p.stat()
+                except FileNotFoundError:
+                    continue
+                if p.is_file():
+                    size += info.st_size
+                # Downloads read the files, renders and resumes write them
+                last_used = max(last_used, info.st_atime, info.st_mtime)
+            runs.append((last_used, size, d))
+        total = sum(size for _, size, _ in runs)
+        pruned = []
+        for _, size, d in sorted(runs):
+            if total <= self.output_max_bytes:
+                break
+            if d.resolve() in keep:
+                continue
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+            pruned.append(d)
+        return pruned
+
+def default_workspace():
+    root = Path(os.environ.get("CLIPSTORM_SCRATCH_DIR", Path(tempfile.gettempdir()) / "clipstorm_scratch"))
+    output_gb = float(os.environ.get("CLIPSTORM_OUTPUT_MAX_GB", "100"))
+    return Workspace(root, int(output_gb * 1024**3) or None)
+
+def partial_path(final: Path):
+    # Same folder, so the finished file can be renamed into place; hidden, and keeps the extension for ffmpeg's muxer
+    return final.with_name(f".{final.stem}.partial{final.suffix}")
+
+def place_file(src: Path, dest: Path):
+    # A cache entry becomes the output without copying it when both are on one filesystem
+    dest.unlink(missing_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+class Transcriber:
+    """Transcribes voiceovers with one shared Whisper model on a background thread.
+
+    Each voiceover is transcribed once: segments and the SRT built from them are stored in
+    the intermediate cache, keyed by the voiceover's content, its trim span and the model name.
+    """
+
+    def __init__(self, cache: IntermediateCache, model_name="base"):
+        self.cache = cache
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        self._futures = {}
+        # Whisper models are not safe to share between threads, so transcriptions run one at a time
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
+    def submit(self, audio: Path, start, dur):
+        """Queue the trimmed span of audio for transcription (once per content) and return a future resolving to its SRT path."""
+        key = (self.cache.digest(Path(audio)), start, dur)
+        with self._lock:
+            fut = self._futures.get(key)
+            if fut is not None and fut.done() and fut.exception() is None:
+                srt = fut.result()
+                if srt.exists():
+                    # Reused without a cache fetch, so keep the entry recently used the way a hit would
+                    os.utime(srt, (time.time(), srt.stat().st_mtime))
+                else:
+                    # Evicted from the cache since; transcribed again (or rebuilt from its cached segments)
+                    fut = None
+            if fut is None or (fut.done() and fut.exception() is not None):
+                # Run in the caller's context so the transcription is logged to the run that asked for it
+                fut = self._futures[key] = self._pool.submit(contextvars.copy_context().run, self._srt, Path(audio), start, dur)
+        return fut
+
+    def _transcribe(self, audio: Path, start, dur, dest: Path):
+        if self._model is None:
+            # Imported lazily so renders without captions don't need torch installed
+            import whisper
+            self._model = whisper.load_model(self.model_name)
+        with timed_stage("transcribe", file_bytes(audio)):
+            # Decode just the trimmed span straight to Whisper's 16 kHz mono float input
+            r = subprocess.run(["ffmpeg", "-v", "error", "-nostdin", *voice_input(audio, start, dur), "-f", "s16le", "-ac", "1", "-ar", "16000", "-"],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+            samples = np.frombuffer(r.stdout, np.int16).astype(np.float32) / 32768.0
+            result = self._model.transcribe(samples, word_timestamps=False)
+        dest.write_text(json.dumps(result['segments']))
+
+    def _srt(self, audio: Path, start, dur):
+        segments = self.cache.fetch([audio], ["whisper", self.model_name, "word_timestamps=False", *trim_args(start, dur)],
+                                    lambda dest: self._transcribe(audio, start, dur, dest), suffix=".json")
+        return self.cache.fetch([segments], ["srt"], lambda dest: write_srt(json.loads(segments.read_text()), dest), suffix=".srt")
+
+def output_name(prefix, parts, idx, suffix=""):
+    try:
+        return sanitize_filename("_".join([sanitize_filename(prefix), *parts]) + suffix) + ".mp4"
+    except Exception:
+        return f"output_{idx}{suffix}.mp4"
+
+def caption_style(video_h):
+    # Dynamically set font size, outline, and y-position for captions
+    font_size = int(video_h * 0.05)
+    stroke_width = int(video_h * 0.003)
+    margin_v = int(video_h - (0.85 * video_h))  # ffmpeg MarginV is from bottom
+    return f"Fontname=Arial,Fontsize={font_size},PrimaryColour=&HFFFFFF&,OutlineColour=&H000000&,BorderStyle=1,Outline={stroke_width},Shadow=0,Alignment=2,Bold=1,MarginV={margin_v}"
+
+# Output formats. Each output is composited once on a 9:16 canvas and split into every profile's
+# encoder, scaled to its size with its aspect reached by cropping or padding the canvas.
+# size None is the original format: 1080×1920 with a body, the hook's own size without one.
+# bitrate (kb/s) None encodes at libx264/libx265's default quality. Files are named <output><suffix>.mp4.
+output_profiles = {
+    "9x16": {"size": None, "fit": "crop", "codec": "libx264", "preset": "veryfast", "bitrate": None, "audio_bitrate": None, "suffix": ""},
+    "9x16_hevc": {"size": (1080, 1920), "fit": "crop", "codec": "libx265", "preset": "fast", "bitrate": None, "audio_bitrate": None,
+                  "suffix": "_hevc"},
+    "9x16_720p": {"size": (720, 1280), "fit": "crop", "codec": "libx264", "preset": "veryfast", "bitrate": 2500, "audio_bitrate": 128,
+                  "suffix": "_720p"},
+    "4x5": {"size": (1080, 1350), "fit": "crop", "codec": "libx264", "preset": "veryfast", "bitrate": None, "audio_bitrate": None, "suffix": "_4x5"},
+    "1x1": {"size": (1080, 1080), "fit": "crop", "codec": "libx264", "preset": "veryfast", "bitrate": None, "audio_bitrate": None, "suffix": "_1x1"},
+    "16x9": {"size": (1920, 1080), "fit": "pad", "codec": "libx264", "preset": "veryfast", "bitrate": None, "audio_bitrate": None, "suffix": "_16x9"},
+    # Review proxies: small, fast to encode and light enough to stream a whole matrix of them.
+    # Named like the full-quality outputs; a draft run folder only ever holds drafts
+    "draft": {"size": (270, 480), "fit": "crop", "codec": "libx264", "preset": "ultrafast", "bitrate": 400, "audio_bitrate": 64, "suffix": ""},
+}
+default_profiles = ("9x16",)
+
+def parse_profile(spec):
+    """An output_profiles name, or a custom WIDTHxHEIGHT[:KBPS][:hevc] (e.g. 1080x1080:4000); returns (name, profile)."""
+    if spec in output_profiles:
+        return spec, output_profiles[spec]
+    size, *rest = spec.split(":")
+    try:
+        w, h = (int(x) for x in size.lower().split("x"))
+        bitrate = next((int(x) for x in rest if x.isdigit()), None)
+    except ValueError:
+        raise ValueError(f"Unknown output profile {spec!r}: use one of {', '.join(output_profiles)} or WIDTHxHEIGHT[:KBPS][:hevc]")
+    hevc = "hevc" in rest
+    name = sanitize_filename(spec.replace(":", "_"))
+    return name, {"size": (w - w % 2, h - h % 2), "fit": "pad" if w > h else "crop", "codec": "libx265" if hevc else "libx264",
+                  "preset": "fast" if hevc else "veryfast", "bitrate": bitrate, "audio_bitrate": None, "suffix": f"_{name}"}
+
+def resolve_profiles(profiles=None):
+    """name -> profile for output profile names or custom specs (see parse_profile), default_profiles if none.
+
+    A mapping, as saved in a run's journal, is returned as is.
+    """
+    if isinstance(profiles, dict):
+        return profiles
+    return dict(parse_profile(spec) for spec in profiles or default_profiles)
+
+def profile_file(name, profile):
+    """The file name of an output (as named by job_outputs) in the given profile."""
+    return f"{Path(name).stem}{profile['suffix']}.mp4"
+
+def profile_args(profile, threads=None):
+    """Encoder arguments for one profile's output."""
+    args = x264_args(threads, profile["preset"])
+    if profile["codec"] != "libx264":
+        args[1] = profile["codec"]
+    if profile["codec"] == "libx265":
+        # So Apple players accept HEVC in mp4
+        args += ["-tag:v", "hvc1"]
+    if profile["bitrate"]:
+        kbps = profile["bitrate"]
+        args += ["-b:v", f"{kbps}k", "-maxrate", f"{kbps * 5 // 4}k", "-bufsize", f"{kbps * 5 // 2}k"]
+    if profile["audio_bitrate"]:
+        args += ["-b:a", f"{profile['audio_bitrate']}k"]
+    return args
+
+def canvas_size(profiles):
+    """The smallest 9:16 frame, up to 1080×1920, that every profile can be cut from without upscaling."""
+    height = 0
+    for profile in profiles:
+        w, h = profile["size"] or (1080, 1920)
+        # Cropping to a wider frame needs the canvas' full width; padding only its height
+        height = max(height, max(h, w * 16 / 9) if profile["fit"] == "crop" else min(h, w * 16 / 9))
+    height = min(1920, int(-(-height // 2) * 2))
+    return int(-(-height * 9 // 32) * 2), height
+
+def fan_out(outputs, canvas, threads):
+    """Filtergraph tail and output arguments that encode the composited [v] and [a] once per (path, profile).
+
+    A single output is encoded straight from the composite; several are fed from split/asplit,
+    so the inputs are decoded and composited once however many profiles there are.
+    """
+    graph = ""
+    n = len(outputs)
+    if n > 1:
+        graph += f";[v]split={n}" + "".join(f"[s{i}]" for i in range(n)) + f";[a]asplit={n}" + "".join(f"[a{i}]" for i in range(n))
+    args = []
+    for i, (path, profile) in enumerate(outputs):
+        v, a = (f"[s{i}]", f"[a{i}]") if n > 1 else ("[v]", "[a]")
+        if profile["size"] is not None and tuple(profile["size"]) != tuple(canvas):
+            w, h = profile["size"]
+            fit = (f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h}" if profile["fit"] == "crop"
+                   else f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:-1:-1")
+            graph += f";{v}{fit},setsar=1[v{i}]"
+            v = f"[v{i}]"
+        args += ["-map", v, "-map", a, *profile_args(profile, threads), str(path)]
+    return graph, args
+
+def single_pass_cmd(h_path: Path, v_path: Path, start, dur, outputs, threads, b_path: Path = None, srt_path: Path = None):
+    """Build one ffmpeg invocation that cuts, muxes, captions and concatenates a single output.
+
+    The combination is composited once and encoded to every (path, profile) in outputs; see fan_out.
+    """
+    # Trim the hook to the voice duration and burn captions at the hook's native size, as the chained path does
+    video = [f"trim=duration={dur}", "setpts=PTS-STARTPTS"]
+    if srt_path is not None:
+        video.append(f"subtitles='{srt_path}':force_style='{caption_style(get_video_height(h_path))}'")
+    audio = [f"atrim=duration={dur}", "asetpts=PTS-STARTPTS"]
+    cmd = ["ffmpeg", "-y", "-t", str(dur), "-i", str(h_path), *voice_input(v_path, start, dur)]
+    if b_path is None:
+        hook = prober.probe(h_path)["video"]
+        canvas = (hook["width"], hook["height"])
+        graph = f"[0:v]{','.join(video)}[v];[1:a]{','.join(audio)}[a]"
+    else:
+        # Same normalization as standard_args, applied in-graph so both segments line up for concat.
+        # Composited no larger than the profiles need, e.g. at draft size for a draft run
+        canvas = canvas_size([profile for _, profile in outputs])
+        size = f"{canvas[0]}:{canvas[1]}"
+        video += [f"scale={size}", "fps=30"]
+        audio += ["aresample=44100", "aformat=channel_layouts=stereo"]
+        graph = (
+            f"[0:v]{','.join(video)}[hv];[1:a]{','.join(audio)}[ha];"
+            f"[2:v]scale={size},fps=30[bv];[2:a]aresample=44100,aformat=channel_layouts=stereo[ba];"
+            "[hv][ha][bv][ba]concat=n=2:v=1:a=1[v][a]"
+        )
+        cmd += ["-i", str(b_path)]
+    tail, output_args = fan_out(outputs, canvas, threads)
+    return cmd + ["-filter_complex", graph + tail, *output_args]
+
+def fan_out_cmd(src: Path, outputs, threads):
+    """Encode an already rendered original-format output to every (path, profile) in outputs."""
+    video = prober.probe(src)["video"]
+    tail, output_args = fan_out(outputs, (video["width"], video["height"]), threads)
+    return ["ffmpeg", "-y", "-i", str(src), "-filter_complex", "[0:v]null[v];[0:a]anull[a]" + tail, *output_args]
+
+def chained_hook_voice(h_path: Path, v_path: Path, start, dur, threads, cache, srt_path: Path = None):
+    """Legacy pipeline: cut the hook, mux the voice, then optionally burn captions, one encode per step."""
+    # h_cut depends only on the hook and the trimmed duration, h_vo on that cut plus the voice
+    h_cut = cache.fetch([h_path], ["-t", str(dur), *x264_args()], lambda dest: ff(
+        ["ffmpeg","-y","-i",str(h_path),"-t",str(dur),*x264_args(threads),str(dest)], "cut"))
+    mux_args = ["-c:v","copy","-map","0:v","-map","1:a","-shortest"]
+    h_vo = cache.fetch([h_cut, v_path], [*trim_args(start, dur), *mux_args], lambda dest: ff(
+        ["ffmpeg","-y","-i",str(h_cut),*voice_input(v_path, start, dur),*mux_args,str(dest)], "mux"))
+    if srt_path is None:
+        return h_vo
+    force_style = caption_style(get_video_height(h_vo))
+    # The SRT is keyed by content, so the per-job path in the filter string stays out of the key
+    return cache.fetch([h_vo, srt_path], ["subtitles", force_style, "-c:a", "copy"], lambda dest: ff([
+        "ffmpeg", "-y", "-i", str(h_vo),
+        "-vf", f"subtitles='{srt_path}':force_style='{force_style}'",
+        "-threads", str(threads), "-c:a", "copy", str(dest)
+    ], "subtitles"))
+
+def chained_output(h_vo: Path, final: Path, scratch: Scratch, threads, cache, warnings, b_path: Path = None, captions=False):
+    """Legacy pipeline: produce final from the muxed hook, re-encoding and concatenating the body if given.
+
+    Writes to final's partial file (see partial_path); render_pair renames it into place.
+    """
+    part = partial_path(final)
+    if b_path is not None:
+        # Always use robust concat filter for body+hook.
+        # Normalized intermediates depend on a single input, so they're shared across the whole matrix
+        h_vo_reenc = cache.fetch([h_vo], [*standard_args, *x264_args()], lambda dest: ff([
+            "ffmpeg", "-y", "-i", str(h_vo),
+            *standard_args,
+            *x264_args(threads), str(dest)
+        ], "normalize"))
+        body_reenc = cache.fetch([b_path], [*standard_args, *x264_args()], lambda dest: ff([
+            "ffmpeg", "-y", "-i", str(b_path),
+            *standard_args,
+            *x264_args(threads), str(dest)
+        ], "normalize"))
+        ff([
+            "ffmpeg", "-y",
+            "-i", str(h_vo_reenc),
+            "-i", str(body_reenc),
+            "-filter_complex", "[0:v][0:a][1:v][1:a]concat=n=2:v=1:a=1[v][a]",
+            "-map", "[v]", "-map", "[a]",
+            *x264_args(threads),
+            str(part)
+        ], "concat")
+    elif captions:
+        place_file(h_vo, part)
+    else:
+        # Use fast concat for hook+voiceover only
+        cat = scratch.path(f"{final.stem}_list.txt")
+        with open(cat, "w") as f: f.write(f"file '{h_vo}'\n")
+        try:
+            ff([
+                "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(cat), "-c", "copy", str(part)
+            ], "concat")
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            warnings.append(f"Fast concat failed for {final.name}, falling back to re-encoding. Reason: {e}")
+            h_vo_reenc = cache.fetch([h_vo], [*standard_args, *x264_args()], lambda dest: ff([
+                "ffmpeg", "-y", "-i", str(h_vo),
+                *standard_args,
+                *x264_args(threads), str(dest)
+            ], "normalize"))
+            place_file(h_vo_reenc, part)
+
+# What standard_args normalizes to; inputs already in this shape can be stream-copied
+target_video = {"codec": "h264", "width": 1080, "height": 1920, "fps": 30.0, "pix_fmt": "yuv420p"}
+target_audio = {"codec": "aac", "profile": "LC", "sample_rate": 44100, "channels": 2}
+# Every normalized segment is encoded with these settings, so any two of them can be joined with -c copy
+segment_filter = "scale=1080:1920,fps=30,format=yuv420p"
+segment_args = ["-profile:v", "high", "-level:v", "4.1", "-video_track_timescale", "15360", "-ar", "44100", "-ac", "2"]
+
+def conforms(stream, target):
+    return stream is not None and all(
+        abs((stream[k] or 0) - v) < 0.01 if isinstance(v, float) else stream[k] == v for k, v in target.items())
+
+def joinable(a, b):
+    """True if the two probe records' streams can be concatenated by the concat demuxer with -c copy."""
+    if not (conforms(a["video"], target_video) and conforms(b["video"], target_video)):
+        return False
+    # Same resolution isn't enough: the joined file carries one SPS/PPS, so the encoder settings must match too
+    keys = ("profile", "level", "time_base", "extradata")
+    return all(a["video"][k] == b["video"][k] for k in keys) and conforms(b["audio"], target_audio)
+
+def plan_output(h_path: Path, b_path: Path = None, captions=False):
+    """Pick how one output is produced from its inputs' probe records.
+
+    "remux": the hook is cut on its first keyframe and the body copied, only the voice is encoded.
+    "join": the hook segment is encoded on its own and joined to the body (as-is if it matches the
+    segment, else its cached normalized copy) without re-encoding either.
+    None: no body and the hook can't be copied; left to the single-pass/chained pipelines.
+    """
+    hook = prober.probe(h_path)
+    copy_hook = not captions and hook["video"] is not None and hook["video"]["codec"] == "h264" and prober.starts_on_keyframe(h_path)
+    if b_path is None:
+        return "remux" if copy_hook else None
+    if copy_hook and joinable(hook, prober.probe(b_path)) and prober.starts_on_keyframe(b_path):
+        return "remux"
+    return "join"
+
+def remux_hook_voice(h_path: Path, v_path: Path, start, dur, dest: Path):
+    # Reading the hook with -t and -c copy stops at the voice's length; the cut starts at 0, on the first keyframe
+    ff(["ffmpeg", "-y", "-t", str(dur), "-i", str(h_path), *voice_input(v_path, start, dur),
+        "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-ar", "44100", "-ac", "2", "-shortest", str(dest)], "remux")
+
+def hook_segment(h_path: Path, v_path: Path, start, dur, threads, cache, srt_path: Path = None):
+    """Encode the trimmed hook with its voice (and captions) as a normalized segment, cached per combination."""
+    video = [f"trim=duration={dur}", "setpts=PTS-STARTPTS"]
+    style = None
+    if srt_path is not None:
+        style = caption_style(get_video_height(h_path))
+        video.append(f"subtitles='{srt_path}':force_style='{style}'")
+    graph = (f"[0:v]{','.join(video)},{segment_filter}[v];"
+             f"[1:a]atrim=duration={dur},asetpts=PTS-STARTPTS,aformat=channel_layouts=stereo[a]")
+    inputs = [h_path, v_path] + ([srt_path] if srt_path is not None else [])
+    return cache.fetch(inputs, ["segment", *trim_args(start, dur), segment_filter, style or "", *segment_args, *x264_args()], lambda dest: ff([
+        "ffmpeg", "-y", "-t", str(dur), "-i", str(h_path), *voice_input(v_path, start, dur),
+        "-filter_complex", graph, "-map", "[v]", "-map", "[a]",
+        *x264_args(threads), *segment_args, str(dest)
+    ], "segment"))
+
+def body_segment(b_path: Path, threads, cache):
+    """The body normalized to the segment settings, shared by every output that uses it."""
+    return cache.fetch([b_path], ["segment", segment_filter, *segment_args, *x264_args()], lambda dest: ff([
+        "ffmpeg", "-y", "-i", str(b_path), "-vf", segment_filter, *x264_args(threads), *segment_args, str(dest)
+    ], "normalize"))
+
+def join_segments(segments, final: Path, scratch: Scratch):
+    cat = scratch.path(f"{final.stem}_list.txt")
+    with open(cat, "w") as f:
+        for seg in segments:
+            f.write(f"file '{Path(seg).resolve()}'\n")
+    ff(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(cat), "-c", "copy", str(final)], "concat")
+
+def stream_copy_output(mode, h_path: Path, v_path: Path, start, dur, final: Path, scratch: Scratch, threads, cache, b_path: Path = None, srt_path: Path = None):
+    """Produce final as planned by plan_output, re-encoding only what doesn't already conform."""
+    if mode == "remux":
+        if b_path is None:
+            remux_hook_voice(h_path, v_path, start, dur, final)
+            return
+        hook = cache.fetch([h_path, v_path], ["remux", *trim_args(start, dur)],
+                           lambda dest: remux_hook_voice(h_path, v_path, start, dur, dest))
+        join_segments([hook, b_path], final, scratch)
+        return
+    hook = hook_segment(h_path, v_path, start, dur, threads, cache, srt_path)
+    body = b_path
+    if not (joinable(prober.probe(hook), prober.probe(b_path)) and prober.starts_on_keyframe(b_path)):
+        body = body_segment(b_path, threads, cache)
+    join_segments([hook, body], final, scratch)
+
+def job_outputs(job, prefix, bodies, captions):
+    """The (body, output file name) pairs a hook × voice job produces, bodies being (name, path) or None."""
+    h_sanitized, v_sanitized = job["hook"][1], job["voice"][0]
+    suffix = "_captioned" if captions else ""
+    outputs = [(body, output_name(prefix, [h_sanitized, v_sanitized] + ([body[0]] if body else []), job["index"], suffix))
+               for body in bodies or [None]]
+    # Only some combinations, e.g. the ones picked from a draft run
+    if job.get("selected") is not None:
+        outputs = [(body, name) for body, name in outputs if name in job["selected"]]
+    return outputs
+
+class JobJournal:
+    """Append-only log of a batch's planned outputs and their status, kept in the run folder.
+
+    The first line is the plan (inputs, settings and every output with the inputs it uses);
+    each later line moves one output to running, done, failed, skipped or cancelled. Appending keeps
+    updates cheap for matrices with thousands of outputs, and a crash loses at most a line.
+    """
+
+    file_name = "journal.jsonl"
+
+    def __init__(self, out: Path):
+        self.path = Path(out) / self.file_name
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, out: Path, plan):
+        journal = cls(out)
+        with open(journal.path, "w") as f:
+            f.write(json.dumps({"type": "plan", **plan}) + "\n")
+        return journal
+
+    def mark(self, output, status, error=None):
+        line = {"type": "status", "output": output, "status": status, "time": time.time()}
+        if error:
+            line["error"] = error
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(line) + "\n")
+
+    @classmethod
+    def load(cls, out: Path):
+        """Return (plan, {output: latest status line}); outputs without a line are still pending."""
+        plan, statuses = None, {}
+        with open(Path(out) / cls.file_name) as f:
+            for raw in f:
+                try:
+                    line = json.loads(raw)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash
+                    continue
+                if line.get("type") == "plan":
+                    plan = line
+                elif line.get("type") == "status":
+                    statuses[line["output"]] = line
+        return plan, statuses
+
+def render_pair(job, scratch: Scratch, out: Path, prefix, bodies, threads, cache, transcriber=None, single_pass=True, journal=None,
+                stream_copy=True, profiles=None):
+    """Render every output for one hook × voice pair. Runs on a worker thread.
+
+    Each output is rendered in every one of profiles (name -> output_profiles entry; the original
+    format by default), all from one ffmpeg process unless it falls back to the chained pipeline.
+    Output files listed in job["done"] are already rendered and verified, and are only reported.
+    Each file is written to a hidden partial file next to it and renamed into place when complete.
+    """
+    profiles = profiles or {name: output_profiles[name] for name in default_profiles}
+    h_path, h_sanitized = job["hook"]
+    v_sanitized, v_path, start, dur = job["voice"]
+    captions = transcriber is not None
+    result = {"index": job["index"], "label": f"{h_sanitized} + {v_sanitized}" + (" (with captions)" if captions else ""),
+              "outputs": [], "errors": [], "warnings": []}
+    srt_path = None
+    h_vo = None
+    outputs = job_outputs(job, prefix, bodies, captions)
+    files = [profile_file(name, profile) for _, name in outputs for profile in profiles.values()]
+    done = job.get("done", ())
+    todo = [(body, name, [(profile, out / profile_file(name, profile)) for profile in profiles.values()
+                          if profile_file(name, profile) not in done])
+            for body, name in outputs]
+    todo = [(body, name, targets) for body, name, targets in todo if targets]
+    result["outputs"] = [str((out / f).resolve()) for f in files if f in done]
+    mark = journal.mark if journal else (lambda *args: None)
+    if not todo:
+        return result
+    try:
+        hook_dur = get_duration(h_path)
+        if hook_dur < dur:
+            result["warnings"].append(f"Warning: Hook video '{h_sanitized}' ({hook_dur:.2f}s) is shorter than trimmed audio '{v_sanitized}' ({dur:.2f}s). Video will be padded to match audio.")
+            for _, _, targets in todo:
+                for _, final in targets:
+                    mark(final.name, "skipped", "hook shorter than voiceover")
+            return result
+        if captions:
+            # Usually already transcribed in the background at upload time; otherwise this waits for Whisper
+            srt_path = transcriber.submit(v_path, start, dur).result()
+    except Exception as e:
+        result["errors"].append(f"{result['label']}: {e}")
+        for _, _, targets in todo:
+            for _, final in targets:
+                mark(final.name, "failed", str(e))
+        return result
+
+    for i, (body, name, targets) in enumerate(todo):
+        b_sanitized, b_path = body if body else (None, None)
+        label = " + ".join([result["label"]] + ([b_sanitized] if body else []))
+        parts = [(profile, final, partial_path(final)) for profile, final in targets]
+        current_output.set(name)
+        for _, final, _ in parts:
+            mark(final.name, "running")
+        try:
+            pending = list(parts)
+            # Only the original format can be stream-copied
+            original = [t for t in pending if t[0] == output_profiles["9x16"]]
+            mode = plan_output(h_path, b_path, captions) if stream_copy and original else None
+            if mode:
+                try:
+                    stream_copy_output(mode, h_path, v_path, start, dur, original[0][2], scratch, threads, cache, b_path, srt_path)
+                    pending.remove(original[0])
+                except RenderCancelled:
+                    raise
+                except Exception as e:
+                    result["warnings"].append(f"Stream-copy render ({mode}) failed for {original[0][1].name}, falling back to re-encoding. Reason: {e}")
+            if pending and single_pass:
+                try:
+                    ff(single_pass_cmd(h_path, v_path, start, dur, [(part, profile) for profile, _, part in pending], threads, b_path, srt_path),
+                       "single_pass", [part for _, _, part in pending])
+                    pending = []
+                except RenderCancelled:
+                    raise
+                except Exception as e:
+                    names = ", ".join(final.name for _, final, _ in pending)
+                    result["warnings"].append(f"Single-pass render failed for {names}, falling back to the chained pipeline. Reason: {e}")
+            if pending:
+                # The chained pipeline renders the original format; any other profiles are encoded from that
+                todo_original = [t for t in pending if t[0] == output_profiles["9x16"]]
+                if original and not todo_original:
+                    # Already stream-copied above, so the combination isn't rendered a second time just to fan out
+                    src = original[0][2]
+                else:
+                    if h_vo is None:
+                        h_vo = chained_hook_voice(h_path, v_path, start, dur, threads, cache, srt_path)
+                    # Otherwise a full-size video in the job's scratch dir, which is on the workspace's disk root
+                    base = todo_original[0][1] if todo_original else scratch.path(name)
+                    chained_output(h_vo, base, scratch, threads, cache, result["warnings"], b_path, captions)
+                    src = partial_path(base)
+                rest = [t for t in pending if t not in todo_original]
+                if rest:
+                    ff(fan_out_cmd(src, [(part, profile) for profile, _, part in rest], threads), "fan_out",
+                       [part for _, _, part in rest])
+            for _, final, part in parts:
+                if part.exists():
+                    os.replace(part, final)
+                    result["outputs"].append(str(final.resolve()))
+                    mark(final.name, "done")
+                else:
+                    result["errors"].append(f"Failed to generate video: {final}")
+                    mark(final.name, "failed", "output missing")
+        except RenderCancelled:
+            # Left for a resume; the journal doesn't count cancelled outputs as finished
+            for _, _, part in parts:
+                part.unlink(missing_ok=True)
+            for _, _, rest in todo[i:]:
+                for _, final in rest:
+                    mark(final.name, "cancelled")
+            break
+        except Exception as e:
+            for _, _, part in parts:
+                part.unlink(missing_ok=True)
+            result["errors"].append(f"{label}: {e}")
+            for _, final, _ in parts:
+                mark(final.name, "failed", str(e))
+    # Keep plan order (resumed outputs first otherwise)
+    order = {str((out / f).resolve()): i for i, f in enumerate(files)}
+    result["outputs"].sort(key=order.get)
+    return result
+
+def run_matrix(jobs, outputs_per_job, render, max_workers, on_progress):
+    """Run render(job) for every job on a bounded worker pool, reporting progress from the calling thread."""
+    total = len(jobs) * outputs_per_job
+    done = 0
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(render, job) for job in jobs]
+        for fut in as_completed(futures):
+            result = fut.result()
+            done += outputs_per_job
+            results.append(result)
+            on_progress(done / total if total else 1.0, result)
+    return sorted(results, key=lambda r: r["index"])
+
+def normalized_name(name):
+    # Sanitized name with a lower-case extension, as uploads are stored and listed
+    name = sanitize_filename(name)
+    if "." in name:
+        base, ext = name.rsplit(".", 1)
+        name = f"{base}.{ext.lower()}"
+    return name
+
+def load_inputs(paths, names=None, trim=False):
+    """Build the records the planner works from: names, path, probe and (for voiceovers) the silence trim."""
+    paths = [Path(p) for p in paths]
+    names = names or [p.name for p in paths]
+    records = []
+    # Probe everything at once instead of one ffprobe after another
+    for path, name, probe in zip(paths, names, prober.probe_many(paths)):
+        record = {"name": sanitize_filename(name), "file_name": normalized_name(name), "path": path, "probe": probe}
+        if trim:
+            # Only the endpoints are detected here; the cut itself happens when rendering
+            start, end = detect_silence_endpoints(path)
+            record["trim"] = (start, end - start)
+        records.append(record)
+    return records
+
+def plan_jobs(hook_records, voice_records):
+    """One job per hook × voice pair; bodies are rendered inside each job."""
+    jobs = []
+    for hook in hook_records:
+        for voice in voice_records:
+            start, dur = voice["trim"]
+            jobs.append({"index": len(jobs) + 1, "hook": (hook["path"], hook["name"]), "voice": (voice["name"], voice["path"], start, dur)})
+    return jobs
+
+def journal_input(record):
+    # Enough of an input record to reload it on resume; probes are redone, trims are kept
+    return {k: (str(v) if k == "path" else v) for k, v in record.items() if k in ("name", "file_name", "path", "trim")}
+
+class Batch:
+    """A planned run: its folder, its hook × voice jobs and how to render one, on whatever pool runs them.
+
+    cancel() stops it: jobs not yet started render nothing and ffmpeg processes it has running
+    are terminated. Their outputs are journaled as cancelled, so the run can be resumed later.
+    """
+
+    def __init__(self, out: Path, jobs, outputs_per_job, render_job, captions=False, draft=False):
+        self.out = out
+        self.jobs = jobs
+        self.outputs_per_job = outputs_per_job
+        self.captions = captions
+        self.draft = draft
+        self.log = StageLog(out)
+        self.cancelled = threading.Event()
+        self._render_job = render_job
+        self._lock = threading.Lock()
+        self._procs = set()
+
+    def render(self, job):
+        # A fresh copy of the worker's context, so this batch's settings don't leak into the worker's next job
+        return contextvars.copy_context().run(self._render, job)
+
+    def _render(self, job):
+        current_batch.set(self)
+        stage_log.set(self.log)
+        return self._render_job(job)
+
+    def track(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+            if not self.cancelled.is_set():
+                return
+        # Started just as the batch was cancelled
+        self._terminate(proc)
+
+    def untrack(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            procs = list(self._procs)
+        for proc in procs:
+            self._terminate(proc)
+
+    @staticmethod
+    def _terminate(proc):
+        # Not Popen.terminate(): its poll() could reap the child before ff()'s wait4 collects its usage
+        try:
+            os.kill(proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+def prepare_batch(hook_records, voice_records, body_records, prefix, captions=False, out_root=Path("rendered_videos"),
+                  single_pass=True, threads=2, cache=None, transcriber=None, out=None, done=frozenset(), stream_copy=True,
+                  workspace=None, draft=False, selected=None, profiles=None):
+    """Plan the hook × voice × body matrix into out_root/<prefix>_[captions_]<timestamp> without rendering it.
+
+    The run folder and a journal of every planned output are created here; the timings of every
+    stage (StageLog) are added as it renders. Passing out (and the verified outputs in done)
+    continues an existing run instead; see prepare_resume. Every output is rendered in each of
+    profiles (see resolve_profiles). With draft, it's only the draft profile, always single pass, in
+    <prefix>_[captions_]draft_<timestamp>; selected (output names) limits the batch to those
+    combinations, as prepare_from_draft does.
+    """
+    cache = cache or default_cache()
+    workspace = workspace or default_workspace()
+    if captions and transcriber is None:
+        transcriber = Transcriber(cache)
+    profiles = {"draft": output_profiles["draft"]} if draft else resolve_profiles(profiles)
+    if draft:
+        # The chained pipeline would encode every step at full size only to shrink the result
+        single_pass = True
+    body_inputs = [(record["file_name"], record["path"]) for record in body_records]
+    jobs = plan_jobs(hook_records, voice_records)
+    if selected is not None:
+        for job in jobs:
+            job["selected"] = frozenset(selected)
+        jobs = [job for job in jobs if job_outputs(job, prefix, body_inputs, captions)]
+    if out is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        name = "_".join([prefix] + (["captions"] if captions else []) + (["draft"] if draft else []) + [timestamp])
+        Path(out_root).mkdir(parents=True, exist_ok=True)
+        # Batches with the same prefix started within the same second (another session, a manifest
+        # repeating a prefix) each get their own folder and journal
+        for n in itertools.count(1):
+            out = Path(out_root) / (name if n == 1 else f"{name}_{n}")
+            try:
+                out.mkdir()
+                break
+            except FileExistsError:
+                continue
+        body_index = {body: i for i, body in enumerate(body_inputs)}
+        journal = JobJournal.create(out, {
+            "prefix": prefix, "captions": captions, "single_pass": single_pass, "stream_copy": stream_copy, "draft": draft,
+            "profiles": profiles,
+            "hooks": [journal_input(r) for r in hook_records],
+            "voices": [journal_input(r) for r in voice_records],
+            "bodies": [journal_input(r) for r in body_records],
+            "outputs": [
+                {"file": profile_file(name, profile), "output": name, "profile": profile_name,
+                 "hook": (job["index"] - 1) // len(voice_records), "voice": (job["index"] - 1) % len(voice_records),
+                 "body": body_index[body] if body else None}
+                for job in jobs for body, name in job_outputs(job, prefix, body_inputs, captions)
+                for profile_name, profile in profiles.items()
+            ],
+        })
+    else:
+        journal = JobJournal(out)
+        # Outputs that were being written when the run was interrupted
+        for part in Path(out).glob(".*.partial.*"):
+            part.unlink(missing_ok=True)
+    for job in jobs:
+        job["done"] = done
+
+    def render(job):
+        # Each pair gets its own scratch dirs, so concurrent jobs never share names, and they're gone when it ends
+        with workspace.scratch() as scratch:
+            return render_pair(job, scratch, out, prefix, body_inputs, threads, cache, transcriber if captions else None,
+                               single_pass, journal, stream_copy, profiles)
+
+    return Batch(out, jobs, max(1, len(body_inputs)) * len(profiles), render, captions, draft)
+
+def render_batch(hook_records, voice_records, body_records, prefix, captions=False, out_root=Path("rendered_videos"),
+                 single_pass=True, max_workers=1, threads=2, cache=None, transcriber=None, on_progress=None,
+                 out=None, done=frozenset(), stream_copy=True, workspace=None, draft=False, profiles=None):
+    """Plan (see prepare_batch) and render a batch on a pool of max_workers in this process.
+
+    Returns the output folder and one result per hook × voice pair, in plan order.
+    """
+    batch = prepare_batch(hook_records, voice_records, body_records, prefix, captions, out_root, single_pass, threads,
+                          cache, transcriber, out, done, stream_copy, workspace, draft, profiles=profiles)
+    results = run_matrix(batch.jobs, batch.outputs_per_job, batch.render, max_workers, on_progress or (lambda fraction, result: None))
+    return batch.out, results
+
+class RenderTicket:
+    """A batch's place in a RenderQueue, and its progress for the page that submitted it to poll."""
+
+    def __init__(self, queue, batch: Batch, session, label):
+        self.queue = queue
+        self.batch = batch
+        self.session = session
+        self.label = label
+        self.submitted = time.time()
+        self.total = len(batch.jobs)
+        self.pending = deque(batch.jobs)
+        self.running = 0
+        self.results = []
+        self.finished = threading.Event()
+
+    @property
+    def progress(self):
+        return len(self.results) / self.total if self.total else 1.0
+
+    @property
+    def cancelled(self):
+        return self.batch.cancelled.is_set()
+
+    def sorted_results(self):
+        return sorted(self.results, key=lambda r: r["index"])
+
+    def cancel(self):
+        self.queue.cancel(self)
+
+class RenderQueue:
+    """Server-wide render queue: every session submits batches to one fixed pool of workers.
+
+    Workers take one hook × voice job at a time, round-robin across sessions (oldest batch
+    first within a session), so the machine runs at most `workers` renders however many people
+    press Generate, and a small batch isn't stuck behind someone else's thousand-video matrix.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._cond = threading.Condition()
+        # session -> its tickets that still have jobs to hand out; the first session is served next
+        self._sessions = OrderedDict()
+        self._active = []
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"render-{i}", daemon=True).start()
+
+    def submit(self, session, batch: Batch, label=""):
+        ticket = RenderTicket(self, batch, session, label)
+        with self._cond:
+            if ticket.pending:
+                self._sessions.setdefault(session, deque()).append(ticket)
+                self._active.append(ticket)
+                self._cond.notify_all()
+            else:
+                ticket.finished.set()
+        return ticket
+
+    def cancel(self, ticket: RenderTicket):
+        ticket.batch.cancel()
+        with self._cond:
+            ticket.pending.clear()
+            tickets = self._sessions.get(ticket.session)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._sessions[ticket.session]
+            if ticket.running == 0:
+                self._finish(ticket)
+
+    def status(self):
+        with self._cond:
+            return {"running": sum(t.running for t in self._active), "queued": sum(len(t.pending) for t in self._active),
+                    "batches": len(self._active)}
+
+    def active_runs(self):
+        """Run folders of batches that are queued or rendering."""
+        with self._cond:
+            return {t.batch.out.resolve() for t in self._active}
+
+    def _finish(self, ticket):
+        ticket.finished.set()
+        if ticket in self._active:
+            self._active.remove(ticket)
+
+    def _next(self):
+        with self._cond:
+            while not self._sessions:
+                self._cond.wait()
+            session, tickets = next(iter(self._sessions.items()))
+            ticket = tickets[0]
+            job = ticket.pending.popleft()
+            ticket.running += 1
+            if not ticket.pending:
+                tickets.popleft()
+            if tickets:
+                self._sessions.move_to_end(session)
+            else:
+                del self._sessions[session]
+            return ticket, job
+
+    def _work(self):
+        while True:
+            ticket, job = self._next()
+            try:
+                result = ticket.batch.render(job)
+            except Exception as e:
+                label = f"{job['hook'][1]} + {job['voice'][0]}"
+                result = {"index": job["index"], "label": label, "outputs": [], "errors": [f"{label}: {e}"], "warnings": []}
+            with self._cond:
+                ticket.results.append(result)
+                ticket.running -= 1
+                if ticket.running == 0 and not ticket.pending:
+                    self._finish(ticket)
+
+def verify_output(fp: Path, expected_dur, tolerance=0.5):
+    """True if fp looks like a finished render: audio and video present and roughly the planned length."""
+    if not fp.exists() or fp.stat().st_size == 0:
+        return False
+    record = prober.probe(fp)
+    return bool(record["video"] and record["audio"]) and abs(record["duration"] - expected_dur) <= max(tolerance, 0.02 * expected_dur)
+
+def journal_progress(out: Path):
+    """(plan, verified done output names) for a run folder's journal."""
+    plan, statuses = JobJournal.load(out)
+    voices, bodies = plan["voices"], plan["bodies"]
+    done = set()
+    for entry in plan["outputs"]:
+        if statuses.get(entry["file"], {}).get("status") != "done":
+            continue
+        body_dur = 0.0
+        if entry["body"] is not None:
+            body_path = Path(bodies[entry["body"]]["path"])
+            body_dur = prober.probe(body_path)["duration"] if body_path.exists() else 0.0
+        if verify_output(Path(out) / entry["file"], voices[entry["voice"]]["trim"][1] + body_dur):
+            done.add(entry["file"])
+    return plan, done
+
+def find_incomplete_runs(out_root=Path("rendered_videos")):
+    """Run folders whose journal still has outputs that aren't done (or skipped), newest first."""
+    runs = []
+    for journal_path in sorted(Path(out_root).glob(f"*/{JobJournal.file_name}"), key=lambda p: p.stat().st_mtime, reverse=True):
+        try:
+            plan, statuses = JobJournal.load(journal_path.parent)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if plan is None:
+            continue
+        finished = sum(statuses.get(o["file"], {}).get("status") in ("done", "skipped") for o in plan["outputs"])
+        if finished < len(plan["outputs"]):
+            runs.append((journal_path.parent, finished, len(plan["outputs"])))
+    return runs
+
+def journal_records(out: Path, plan):
+    """Input records for a journaled run, with the trims it was planned with."""
+    records = {}
+    for kind in ("hooks", "voices", "bodies"):
+        missing = [i["path"] for i in plan[kind] if not Path(i["path"]).exists()]
+        if missing:
+            raise FileNotFoundError(f"Inputs for {out} are gone: {', '.join(missing)}")
+        records[kind] = load_inputs([i["path"] for i in plan[kind]], [i["name"] for i in plan[kind]])
+        for record, saved in zip(records[kind], plan[kind]):
+            record.update(journal_input(saved))
+            record["path"] = Path(saved["path"])
+    return records
+
+def prepare_resume(out: Path, **kwargs):
+    """Plan the rest of an interrupted run, in place: verified outputs are kept, the rest are rendered again."""
+    plan, done = journal_progress(out)
+    if plan is None:
+        raise ValueError(f"No plan in {Path(out) / JobJournal.file_name}")
+    records = journal_records(out, plan)
+    kwargs.setdefault("single_pass", plan["single_pass"])
+    kwargs.setdefault("stream_copy", plan.get("stream_copy", True))
+    kwargs.setdefault("draft", plan.get("draft", False))
+    kwargs.setdefault("profiles", plan.get("profiles"))
+    return prepare_batch(records["hooks"], records["voices"], records["bodies"], plan["prefix"], plan["captions"],
+                         out=Path(out), done=frozenset(done), selected={o.get("output", o["file"]) for o in plan["outputs"]}, **kwargs)
+
+def prepare_from_draft(draft_out: Path, selected, **kwargs):
+    """Plan full-quality renders of the selected outputs of a draft run, into a new run folder,
+    in the profiles given in kwargs (the original format by default).
+
+    The voiceover trims are taken from the draft's journal and transcripts come from the cache,
+    so neither is computed again.
+    """
+    plan, _ = JobJournal.load(draft_out)
+    if plan is None:
+        raise ValueError(f"No plan in {Path(draft_out) / JobJournal.file_name}")
+    missing = set(selected) - {o["file"] for o in plan["outputs"]}
+    if missing:
+        raise ValueError(f"Not in {draft_out}: {', '.join(sorted(missing))}")
+    records = journal_records(draft_out, plan)
+    return prepare_batch(records["hooks"], records["voices"], records["bodies"], plan["prefix"], plan["captions"],
+                         draft=False, selected=set(selected), **kwargs)
+
+def resume_batch(out: Path, max_workers=1, on_progress=None, **kwargs):
+    """Continue an interrupted run (see prepare_resume) on a pool of max_workers in this process."""
+    batch = prepare_resume(out, **kwargs)
+    results = run_matrix(batch.jobs, batch.outputs_per_job, batch.render, max_workers, on_progress or (lambda fraction, result: None))
+    return batch.out, results
+
+def read_manifest(path: Path):
+    """Parse a JSON or CSV manifest into a list of batches."""
+    path = Path(path)
+    resolve = lambda p: p if Path(p).is_absolute() else str(path.parent / p)
+    if path.suffix.lower() == ".csv":
+        batches = {}
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                captions = row.get("captions", "").strip().lower() in ("1", "true", "yes", "y")
+                batch = batches.setdefault((row["prefix"], captions), {"prefix": row["prefix"], "captions": captions, "hooks": [], "voices": [], "bodies": []})
+                kind = {"hook": "hooks", "voice": "voices", "body": "bodies"}[row["kind"].strip().lower()]
+                batch[kind].append(row["path"])
+        batches = list(batches.values())
+    else:
+        with open(path) as f:
+            data = json.load(f)
+        batches = data if isinstance(data, list) else [data]
+    for batch in batches:
+        for kind in ("hooks", "voices", "bodies"):
+            batch[kind] = [resolve(p) for p in batch.get(kind) or []]
+        batch["captions"] = bool(batch.get("captions", False))
+    return batches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render Clipstorm batches from a manifest, without the web UI.")
+    parser.add_argument("manifest", type=Path, nargs="?", help="JSON or CSV manifest of hooks, voices, bodies, prefix and captions flag")
+    parser.add_argument("--resume", type=Path, metavar="RUN_DIR", action="append", default=[],
+                        help="continue an interrupted run folder, re-rendering only outputs that aren't verified done (repeatable)")
+    parser.add_argument("--out", type=Path, default=Path("rendered_videos"), help="root folder for run output (default: rendered_videos)")
+    cpu_count = os.cpu_count() or 1
+    parser.add_argument("--threads", type=int, default=min(2, cpu_count), help="libx264 threads per render")
+    parser.add_argument("--jobs", type=int, default=None, help="parallel renders (default: cores / threads)")
+    parser.add_argument("--chained", action="store_true", help="use the legacy one-encode-per-step pipeline")
+    parser.add_argument("--no-stream-copy", dest="stream_copy", action="store_false",
+                        help="always re-encode, even when inputs already match the output format")
+    parser.add_argument("--nice", type=int, default=0, help="raise this process's (and ffmpeg's) niceness by N")
+    parser.add_argument("--profile", metavar="PROFILE", action="append", default=[],
+                        help=f"output profile, one of {', '.join(p for p in output_profiles if p != 'draft')} or WIDTHxHEIGHT[:KBPS][:hevc]; "
+                             "repeatable, every profile is encoded from one decode (default: 9x16, or the manifest's profiles)")
+    parser.add_argument("--draft", action="store_true", help="render low-res review proxies ({}x{}) of the whole matrix".format(*output_profiles["draft"]["size"]))
+    parser.add_argument("--from-draft", type=Path, metavar="DRAFT_DIR", help="render selected outputs of a draft run at full quality")
+    parser.add_argument("--select", metavar="FILE", action="append", default=[],
+                        help="an output file name of the --from-draft run to render (repeatable)")
+    args = parser.parse_args(argv)
+    if not args.manifest and not args.resume and not args.from_draft:
+        parser.error("give a manifest, --resume RUN_DIR or --from-draft DRAFT_DIR")
+    if args.from_draft and not args.select:
+        parser.error("--from-draft needs at least one --select FILE")
+    try:
+        resolve_profiles(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.nice:
+        # ffmpeg children inherit the niceness
+        os.nice(args.nice)
+    max_workers = args.jobs or max(1, cpu_count // args.threads)
+    cache = default_cache()
+    workspace = default_workspace()
+    transcriber = None
+    failed = False
+    # Never pruned to make room for a later batch of the same invocation
+    produced = set()
+
+    def on_progress(fraction, result):
+        print(f"[{fraction:6.1%}] {result['label']}", flush=True)
+
+    def report(name, out, results):
+        nonlocal failed
+        for r in results:
+            for w in r["warnings"]:
+                print(w, file=sys.stderr)
+            for e in r["errors"]:
+                print(f"Error: {e}", file=sys.stderr)
+                failed = True
+        print(f"{name}: {sum(len(r['outputs']) for r in results)} videos in {out}")
+        totals, _ = summarize_stages(StageLog.load(out))
+        for t in totals:
+            speed = f", {t['avg_speed']:.1f}x" if t["avg_speed"] else ""
+            print(f"  {t['stage']:<12} {t['runs']:>4} runs  {t['wall']:8.1f}s wall  {t['cpu']:8.1f}s cpu{speed}")
+
+    for run_dir in args.resume:
+        try:
+            out, results = resume_batch(run_dir, max_workers=max_workers, threads=args.threads, cache=cache, on_progress=on_progress,
+                                        workspace=workspace)
+            produced.add(out)
+        except (OSError, ValueError) as e:
+            print(f"{run_dir}: can't resume: {e}", file=sys.stderr)
+            failed = True
+            continue
+        report(run_dir.name, out, results)
+    if args.from_draft:
+        try:
+            batch = prepare_from_draft(args.from_draft, args.select, out_root=args.out, single_pass=not args.chained,
+                                       threads=args.threads, cache=cache, stream_copy=args.stream_copy, workspace=workspace,
+                                       profiles=args.profile)
+        except (OSError, ValueError) as e:
+            print(f"{args.from_draft}: can't render from draft: {e}", file=sys.stderr)
+            failed = True
+        else:
+            results = run_matrix(batch.jobs, batch.outputs_per_job, batch.render, max_workers, on_progress)
+            produced.add(batch.out)
+            report(args.from_draft.name, batch.out, results)
+    for batch in read_manifest(args.manifest) if args.manifest else []:
+        inputs = {}
+        for kind, exts in (("hooks", video_exts), ("voices", audio_exts), ("bodies", video_exts)):
+            paths = [Path(p) for p in batch[kind]]
+            bad = [p for p in paths if p.suffix.lower() not in exts or not p.exists()]
+            if bad:
+                print(f"{batch['prefix']}: skipping missing or unsupported {kind}: {', '.join(map(str, bad))}", file=sys.stderr)
+            inputs[kind] = load_inputs([p for p in paths if p not in bad], trim=kind == "voices")
+        if not inputs["hooks"] or not inputs["voices"]:
+            print(f"{batch['prefix']}: needs at least one hook and voice", file=sys.stderr)
+            failed = True
+            continue
+        if batch["captions"] and transcriber is None:
+            transcriber = Transcriber(cache)
+        for pruned in workspace.prune_runs(args.out, keep=produced):
+            print(f"Deleted {pruned} to keep {args.out} within CLIPSTORM_OUTPUT_MAX_GB", file=sys.stderr)
+        try:
+            profiles = resolve_profiles(args.profile or batch.get("profiles"))
+        except ValueError as e:
+            print(f"{batch['prefix']}: {e}", file=sys.stderr)
+            failed = True
+            continue
+        out, results = render_batch(
+            inputs["hooks"], inputs["voices"], inputs["bodies"], batch["prefix"], batch["captions"], args.out,
+            not args.chained, max_workers, args.threads, cache, transcriber, on_progress, stream_copy=args.stream_copy,
+            workspace=workspace, draft=args.draft, profiles=profiles,
+        )
+        produced.add(out)
+        report(batch["prefix"], out, results)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,402 +1,428 @@
-import os, shutil, subprocess, tempfile, platform
+import os, shutil, threading
+import time
+import uuid
 from pathlib import Path
-from pydub import AudioSegment, silence
 import streamlit as st
-from datetime import datetime
 import zipfile
-import io
-import whisper
-import json
-import re
+import hashlib
+from clipstorm_engine import (
+    JobJournal, RenderQueue, StageLog, Transcriber, audio_exts, default_cache, default_profiles, default_workspace,
+    find_incomplete_runs, load_inputs, normalized_name, output_profiles, prepare_batch, prepare_from_draft, prepare_resume,
+    summarize_stages, video_exts,
+)
 
 st.set_page_config(page_title="Clipstorm", layout="centered")
 
 st.title("🎥 Clipstorm Video Generator")
 
-def sanitize_filename(name):
-    # Replace spaces and apostrophes with underscores, remove non-ASCII
-    name = re.sub(r"[’'\"\\s]", "_", name)
-    name = re.sub(r"[^a-zA-Z0-9._-]", "", name)
-    return name
-
-def trim_silence(fp: Path, tmp: Path):
+@st.cache_resource
+def get_intermediate_cache():
+    return default_cache()
+
+@st.cache_resource
+def get_transcriber(model_name="base"):
+    # One model per server process, shared by every session and rerun
+    return Transcriber(get_intermediate_cache(), model_name)
+
+@st.cache_resource
+def get_workspace():
+    # Scratch dirs and the rendered_videos quota, shared by every session
+    return default_workspace()
+
+@st.cache_resource
+def get_render_queue():
+    # One fixed pool of render workers for the whole server; by default, with 2 libx264 threads each, about one per core
+    workers = os.environ.get("CLIPSTORM_RENDER_WORKERS")
+    return RenderQueue(int(workers) if workers else max(1, (os.cpu_count() or 1) // 2))
+
+# Files published here are served straight from disk by Streamlit's static route (server.enableStaticServing)
+static_exports_dir = Path(__file__).resolve().parent / "static" / "exports"
+# Streamlit refuses to serve static files above 200 MB and disables the route at startup above 1 GB
+static_file_limit = 200 * 1024**2
+static_folder_budget = 768 * 1024**2
+
+def build_zip_parts(videos, dest_dir: Path, max_part_bytes=static_file_limit - 8 * 1024**2):
+    """Write videos into uncompressed ZIP parts on disk and return their paths.
+
+    H.264 doesn't deflate, so stored mode costs nothing in size and lets zipfile copy each
+    video in chunks. Parts are sized to stay servable from the static route, and a run's
+    parts are reused if they're already newer than every video in them.
+    """
+    videos = [Path(v) for v in videos if Path(v).exists()]
+    parts, current, size = [], [], 0
+    for video in videos:
+        video_size = video.stat().st_size
+        if current and size + video_size > max_part_bytes:
+            parts.append(current)
+            current, size = [], 0
+        current.append(video)
+        size += video_size
+    if current:
+        parts.append(current)
+    names = ["all_videos.zip"] if len(parts) == 1 else [f"all_videos_part{i + 1}.zip" for i in range(len(parts))]
+    paths = []
+    for name, members in zip(names, parts):
+        zip_path = dest_dir / name
+        newest = max(m.stat().st_mtime for m in members)
+        if not zip_path.exists() or zip_path.stat().st_mtime < newest:
+            partial = zip_path.with_name(f".{name}.partial")
+            with zipfile.ZipFile(partial, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zipf:
+                for member in members:
+                    zipf.write(member, arcname=member.name)
+            os.replace(partial, zip_path)
+        paths.append(zip_path)
+    return paths
+
+def publish_static(fp: Path):
+    """Hard-link fp under static/exports and return its app URL, or None if it can't be served that way."""
+    if not st.get_option("server.enableStaticServing") or fp.stat().st_size > static_file_limit:
+        return None
+    run_dir = static_exports_dir / fp.parent.name
+    link = run_dir / fp.name
     try:
-        audio = AudioSegment.from_file(fp)
-    except Exception as e:
-        # Fallback: convert to wav with ffmpeg and try again
-        if fp.suffix.lower() == ".m4a":
-            converted = tmp / f"{fp.stem}_converted.wav"
-            subprocess.run([
-                "ffmpeg", "-y", "-i", str(fp), str(converted)
-            ], check=True)
-            audio = AudioSegment.from_file(converted)
-            fp = converted
-        else:
-            raise e
-    # Endpoint-only trimming: only trim silence at start/end, not in the middle
-    silence_thresh = audio.dBFS - 20
-    min_silence_len = 100  # short, just to detect endpoints
-    nonsilent = silence.detect_nonsilent(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
-    if not nonsilent:
-        return fp, len(audio)/1000
-    # Only trim the start and end
-    start_trim = max(nonsilent[0][0] - 50, 0)
-    end_trim = min(nonsilent[-1][1] + 50, len(audio))
-    trimmed = audio[start_trim:end_trim]
-    out = tmp / f"{fp.stem}_trimmed.wav"
-    trimmed.export(out, format="wav")
-    return out, len(trimmed)/1000
-
-def get_duration(fp: Path):
-    r = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nokey=1:noprint_wrappers=1", str(fp)],
-                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    return float(r.stdout) if r.stdout else 0.0
-
-def ff(cmd): subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-def write_srt(segments, out_path):
-    def format_srt_time(seconds):
-        h = int(seconds // 3600)
-        m = int((seconds % 3600) // 60)
-        s = int(seconds % 60)
-        ms = int((seconds - int(seconds)) * 1000)
-        return f"{h:02}:{m:02}:{s:02},{ms:03}"
-    with open(out_path, "w") as f:
-        for i, seg in enumerate(segments):
-            start = seg['start']
-            end = seg['end']
-            text = seg['text'].strip()
-            # Remove trailing period
-            if text.endswith('.'):
-                text = text[:-1]
-            f.write(f"{i+1}\n")
-            f.write(f"{format_srt_time(start)} --> {format_srt_time(end)}\n")
-            f.write(f"{text}\n\n")
-
-def get_video_height(fp: Path):
-    r = subprocess.run([
-        "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=height", "-of", "json", str(fp)
-    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    info = json.loads(r.stdout)
-    return info['streams'][0]['height'] if 'streams' in info and info['streams'] else 720
+        run_dir.mkdir(parents=True, exist_ok=True)
+        if not link.exists() or not os.path.samefile(link, fp):
+            link.unlink(missing_ok=True)
+            # Only a new link can take the folder over budget, so reruns that list existing links don't walk it.
+            # Streamlit turns the static route off at startup once the folder is over 1 GB, so never go past the budget
+            if prune_static_exports(keep=run_dir, room=fp.stat().st_size) + fp.stat().st_size > static_folder_budget:
+                return None
+            os.link(fp, link)
+    except OSError:
+        # Different filesystem or no hard-link support; fall back to on-demand downloads
+        return None
+    os.utime(run_dir)
+    return f"app/static/exports/{run_dir.name}/{link.name}"
+
+def prune_static_exports(keep: Path, room=0):
+    """Drop the least recently published runs' links until room more bytes fit in static_folder_budget.
+
+    The videos themselves stay in rendered_videos. Returns the bytes left under static/exports.
+    """
+    runs = sorted((d for d in static_exports_dir.iterdir() if d.is_dir()), key=lambda d: d.stat().st_mtime)
+    total = sum(f.stat().st_size for d in runs for f in d.iterdir())
+    for run_dir in runs:
+        if total + room <= static_folder_budget:
+            break
+        if run_dir == keep:
+            continue
+        total -= sum(f.stat().st_size for f in run_dir.iterdir())
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return total
+
+def download_link(fp: Path, key, label="Download", mime="video/mp4"):
+    """Offer fp for download without holding it in memory on every rerun."""
+    url = publish_static(fp)
+    if url:
+        st.markdown(f'<a href="{url}" download="{fp.name}">{label}</a>', unsafe_allow_html=True)
+    elif st.session_state.get("prepared_download") == str(fp):
+        # Read only the one file the user asked for, and only on this rerun: the next one (the download's, or
+        # any other) drops it, so the video isn't read into memory again on every rerun while it's offered
+        with open(fp, "rb") as f:
+            st.download_button(label=label, data=f, file_name=fp.name, mime=mime, key=f"{key}_ready")
+        del st.session_state["prepared_download"]
+    elif st.button(f"Prepare {label.lower()}", key=f"{key}_prepare"):
+        st.session_state["prepared_download"] = str(fp)
+        st.rerun()
+
+# Uploads are persisted here once, one directory per uploaded file
+ingest_dir = Path(os.environ.get("CLIPSTORM_INGEST_DIR", get_workspace().root / "uploads"))
+# Uploads no session has shown for this long are deleted (a session that still has one ingests it again)
+upload_ttl = float(os.environ.get("CLIPSTORM_UPLOAD_TTL_HOURS", "24")) * 3600
+
+@st.cache_resource
+def upload_pruning():
+    return {"last": 0.0, "lock": threading.Lock()}
+
+def prune_uploads():
+    # At most hourly, from whichever session's rerun gets here first
+    state = upload_pruning()
+    now = time.time()
+    with state["lock"]:
+        if now - state["last"] < 3600 or not ingest_dir.exists():
+            return
+        state["last"] = now
+    for d in ingest_dir.iterdir():
+        if d.is_dir() and d.stat().st_mtime < now - upload_ttl:
+            shutil.rmtree(d, ignore_errors=True)
+
+def ingest_uploads(uploads, allowed_exts, label, trim=False):
+    """Persist each upload exactly once and return its stored record.
+
+    Streamlit reruns the whole script on every widget change, so records (path, probe and,
+    for voiceovers, the silence trim) are kept in session state under the uploader's file id,
+    or a content hash when no id is available. Reruns only read them back.
+    """
+    ingested = st.session_state.setdefault("ingested", {})
+    records, fresh = [], []
+    for upload in uploads or []:
+        if Path(upload.name).suffix.lower() not in allowed_exts:
+            st.error(f"Unsupported {label} file type: {upload.name}")
+            continue
+        file_key = getattr(upload, "file_id", None) or hashlib.sha256(upload.getbuffer()).hexdigest()
+        if file_key not in ingested or not ingested[file_key]["path"].exists():
+            file_name = normalized_name(upload.name)
+            path = ingest_dir / file_key / file_name
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                partial = path.with_name(f".{file_name}.partial")
+                with open(partial, "wb") as f: f.write(upload.getbuffer())
+                os.replace(partial, path)
+            fresh.append((file_key, upload.name, path))
+        records.append(file_key)
+    # Probe (and trim) only what was ingested on this run, all uploads at once
+    loaded = load_inputs([path for _, _, path in fresh], [name for _, name, _ in fresh], trim=trim)
+    for (file_key, _, _), record in zip(fresh, loaded):
+        ingested[file_key] = record
+    for file_key in records:
+        # Marks the upload as in use for prune_uploads
+        os.utime(ingested[file_key]["path"].parent)
+    return [ingested[file_key] for file_key in records]
 
 prefix = st.text_input("Filename prefix", "")
 # Accept all files, filter manually
 hooks = st.file_uploader("Upload hook videos", accept_multiple_files=True)
 voices = st.file_uploader("Upload voiceovers", accept_multiple_files=True)
 bodies = st.file_uploader("Optional: upload body videos", accept_multiple_files=True)
+pretranscribe = st.checkbox("Transcribe voiceovers in the background for captions", value=True)
 
-allowed_video_exts = {".mp4", ".mov"}
-allowed_audio_exts = {".wav", ".mp3", ".m4a"}
-
-# Store trimmed voiceover paths and durations
-trimmed_voices = []
+prune_uploads()
+hook_records = ingest_uploads(hooks, video_exts, "video")
+voice_records = ingest_uploads(voices, audio_exts, "audio", trim=True)
+body_records = ingest_uploads(bodies, video_exts, "body video")
 
 # Show uploaded file durations immediately after upload
-if hooks:
+if hook_records:
     st.markdown("#### Hook video durations:")
-    for h in hooks:
-        ext = Path(h.name).suffix.lower()
-        if ext not in allowed_video_exts:
-            st.error(f"Unsupported video file type: {h.name}")
-            continue
-        h_name = sanitize_filename(h.name)
-        if "." in h_name:
-            base, ext2 = h_name.rsplit(".", 1)
-            h_name = f"{base}.{ext2.lower()}"
-        h_path = Path(tempfile.gettempdir()) / h_name
-        with open(h_path, "wb") as f: f.write(h.getbuffer())
-        dur = get_duration(h_path)
-        st.write(f"{h_name}: {dur:.2f} seconds")
-if voices:
+    for record in hook_records:
+        st.write(f"{record['file_name']}: {record['probe']['duration']:.2f} seconds")
+if voice_records:
     st.markdown("#### Voiceover durations (original → trimmed):")
-    for v in voices:
-        ext = Path(v.name).suffix.lower()
-        if ext not in allowed_audio_exts:
-            st.error(f"Unsupported audio file type: {v.name}")
-            continue
-        v_name = sanitize_filename(v.name)
-        if "." in v_name:
-            base, ext2 = v_name.rsplit(".", 1)
-            v_name = f"{base}.{ext2.lower()}"
-        v_path = Path(tempfile.gettempdir()) / v_name
-        with open(v_path, "wb") as f: f.write(v.getbuffer())
-        orig_dur = get_duration(v_path)
-        # Trim immediately after upload
-        trimmed_path, trimmed_dur = trim_silence(v_path, Path(tempfile.gettempdir()))
-        trimmed_voices.append((trimmed_path, trimmed_dur))
+    for record in voice_records:
+        orig_dur = record["probe"]["duration"]
+        trim_start, trimmed_dur = record["trim"]
+        if pretranscribe:
+            get_transcriber().submit(record["path"], trim_start, trimmed_dur)
         percent_trimmed = 100 * (orig_dur - trimmed_dur) / orig_dur if orig_dur > 0 else 0
-        st.write(f"{v_name}: {orig_dur:.2f}s → {trimmed_dur:.2f}s ({percent_trimmed:.1f}% trimmed)")
-if bodies:
-    for b in bodies:
-        ext = Path(b.name).suffix.lower()
-        if ext not in allowed_video_exts:
-            st.error(f"Unsupported body video file type: {b.name}")
-            continue
-        b_name = sanitize_filename(b.name)
-        if "." in b_name:
-            base, ext2 = b_name.rsplit(".", 1)
-            b_name = f"{base}.{ext2.lower()}"
-        b_path = Path(tempfile.gettempdir()) / b_name
-        with open(b_path, "wb") as f: f.write(b.getbuffer())
+        st.write(f"{record['file_name']}: {orig_dur:.2f}s → {trimmed_dur:.2f}s ({percent_trimmed:.1f}% trimmed)")
 
 if "exported_videos" not in st.session_state:
     st.session_state["exported_videos"] = []
 
-processing = False
-if st.button("Generate"):
-    processing = True
-    if not prefix: st.error("Enter a prefix"); st.stop()
-    if not hooks or not voices: st.error("Upload at least one hook and voice"); st.stop()
-
-    tmp = Path(tempfile.mkdtemp())
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    out = Path("rendered_videos") / f"{prefix}_{timestamp}"
-    out.mkdir(parents=True, exist_ok=True)
-    total = len(hooks) * len(voices) * max(1, len(bodies))
-    progress = st.progress(0)
-    idx = 0
-    exported_videos = []
-    short_hook_warnings = []
-
-    # Standardize video/audio properties for concat compatibility
-    standard_args = ["-vf", "scale=1080:1920", "-r", "30", "-ar", "44100", "-ac", "2"]
-
-    for h in hooks:
-        h_sanitized = sanitize_filename(h.name)
-        h_path = tmp / h_sanitized
-        with open(h_path, "wb") as f: f.write(h.getbuffer())
-        for v_idx, v in enumerate(voices):
-            idx += 1
-            progress.progress(idx/total)
-            v_sanitized = sanitize_filename(v.name)
-            st.write(f"{h_sanitized} + {v_sanitized}")
-            # Use pre-trimmed audio
-            trimmed, dur = trimmed_voices[v_idx]
-            v_path = Path(tempfile.gettempdir()) / v_sanitized
-            # (No need to write v.getbuffer() again)
-            try:
-                hook_dur = get_duration(h_path)
-                if hook_dur < dur:
-                    short_hook_warnings.append(f"Warning: Hook video '{h_sanitized}' ({hook_dur:.2f}s) is shorter than trimmed audio '{v_sanitized}' ({dur:.2f}s). Video will be padded to match audio.")
-                if get_duration(h_path) < dur: continue
-
-                h_cut = tmp / f"{h_path.stem}_cut.mp4"
-                ff(["ffmpeg","-y","-i",str(h_path),"-t",str(dur),"-c:v","libx264","-preset","veryfast","-c:a","aac",str(h_cut)])
-                h_vo = tmp / f"{h_path.stem}_{v_path.stem}_ov.mp4"
-                ff(["ffmpeg","-y","-i",str(h_cut),"-i",str(trimmed),"-c:v","copy","-map","0:v","-map","1:a","-shortest",str(h_vo)])
-
-                if bodies:
-                    for b in bodies:
-                        b_sanitized = sanitize_filename(b.name)
-                        if "." in b_sanitized:
-                            base, ext = b_sanitized.rsplit(".", 1)
-                            b_sanitized = f"{base}.{ext.lower()}"
-                        b_path = tmp / b_sanitized
-                        with open(b_path, "wb") as f: f.write(b.getbuffer())
-                        # Always use robust concat filter for body+hook
-                        h_vo_reenc = tmp / f"{h_vo.stem}_reenc.mp4"
-                        ff([
-                            "ffmpeg", "-y", "-i", str(h_vo),
-                            *standard_args,
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", str(h_vo_reenc)
-                        ])
-                        body_reenc = tmp / f"{b_path.stem}_reenc.mp4"
-                        ff([
-                            "ffmpeg", "-y", "-i", str(b_path),
-                            *standard_args,
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", str(body_reenc)
-                        ])
-                        prefix_sanitized = sanitize_filename(prefix)
-                        concat_out = tmp / f"{prefix_sanitized}_{h_sanitized}_{v_sanitized}_{b_sanitized}_concat.mp4"
-                        ff([
-                            "ffmpeg", "-y",
-                            "-i", str(h_vo_reenc),
-                            "-i", str(body_reenc),
-                            "-filter_complex", "[0:v][0:a][1:v][1:a]concat=n=2:v=1:a=1[v][a]",
-                            "-map", "[v]", "-map", "[a]",
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac",
-                            str(concat_out)
-                        ])
-                        try:
-                            clean_name = sanitize_filename(f"{prefix_sanitized}_{h_sanitized}_{v_sanitized}_{b_sanitized}") + ".mp4"
-                        except Exception:
-                            clean_name = f"output_{idx}.mp4"
-                        final = out / clean_name
-                        shutil.copy(concat_out, final)
-                        if final.exists():
-                            exported_videos.append(str(final.resolve()))
-                        else:
-                            st.error(f"Failed to generate video: {final}")
-                else:
-                    # Use fast concat for hook+voiceover only
-                    try:
-                        clean_name = sanitize_filename(f"{sanitize_filename(prefix)}_{h_sanitized}_{v_sanitized}") + ".mp4"
-                    except Exception:
-                        clean_name = f"output_{idx}.mp4"
-                    final = out / clean_name
-                    cat = tmp / "list.txt"
-                    with open(cat, "w") as f: f.write(f"file '{h_vo}'\n")
-                    try:
-                        ff([
-                            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(cat), "-c", "copy", str(final)
-                        ])
-                    except Exception as e:
-                        st.warning(f"Fast concat failed for {final.name}, falling back to re-encoding. Reason: {e}")
-                        h_vo_reenc = tmp / f"{h_vo.stem}_reenc.mp4"
-                        ff([
-                            "ffmpeg", "-y", "-i", str(h_vo),
-                            *standard_args,
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", str(h_vo_reenc)
-                        ])
-                        shutil.copy(h_vo_reenc, final)
-                    if final.exists():
-                        exported_videos.append(str(final.resolve()))
-                    else:
-                        st.error(f"Failed to generate video: {final}")
-
-            except Exception as e:
-                st.error(f"Error: {e}")
-
-    st.session_state["exported_videos"] = exported_videos
-    st.success(f"Done! Your videos are ready to download below.")
-
+render_queue = get_render_queue()
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+ticket = st.session_state.get("render_ticket")
+rendering = ticket is not None and not ticket.finished.is_set()
+
+cpu_count = os.cpu_count() or 1
+with st.expander("Render settings"):
+    threads_per_job = st.number_input("libx264 threads per render", min_value=1, max_value=cpu_count, value=min(2, cpu_count))
+    workers = get_render_queue().workers
+    st.caption(f"Renders from every session share one queue of {workers} worker{'s' if workers != 1 else ''} "
+               "(set CLIPSTORM_RENDER_WORKERS to change it).")
+    single_pass = st.radio(
+        "Render pipeline", ["Single pass", "Chained (legacy)"], horizontal=True,
+        help="Single pass builds one ffmpeg filtergraph per output; chained runs one encode per step and is used as a fallback.",
+    ) == "Single pass"
+    stream_copy = st.checkbox(
+        "Stream-copy inputs that already match the output", value=True,
+        help="Hooks and bodies that are already H.264 1080×1920 at 30 fps with the same encoder settings are joined without "
+             "re-encoding; otherwise only the hook segment is encoded per video and each body is normalized once.",
+    )
+    profiles = st.multiselect(
+        "Output profiles", [name for name in output_profiles if name != "draft"], default=list(default_profiles),
+        help="Every video is decoded and composited once and encoded to each selected format; files other than 9x16 "
+             "are named with the profile, e.g. _1x1.",
+    )
+    draft = st.checkbox(
+        "Draft proxies for review", value=False,
+        help="Renders every combination as a small {}×{} proxy to review below; ".format(*output_profiles["draft"]["size"])
+             + "only the ones you select are then rendered at full quality, in the output profiles above.",
+    )
+    cache = get_intermediate_cache()
+    if rendering:
+        # Counting entries stats the whole cache, too much for a page that reruns every second while it polls
+        st.caption(f"Intermediate cache in {cache.root} (limit {cache.max_bytes / 1024**3:.0f} GB)")
+    else:
+        cache_stats = cache.stats()
+        st.caption(f"Intermediate cache: {cache_stats['entries']} entries, {cache_stats['bytes'] / 1024**3:.2f} GB in {cache.root} "
+                   f"(limit {cache.max_bytes / 1024**3:.0f} GB)")
+
+resume_dir = None
+# Runs still queued or rendering (from any session) aren't interrupted. Not looked up while polling a render,
+# since it reads every journal under rendered_videos
+incomplete_runs = []
+if not rendering:
+    active_runs = render_queue.active_runs()
+    incomplete_runs = [r for r in find_incomplete_runs() if r[0].resolve() not in active_runs]
+if incomplete_runs:
+    with st.expander(f"Resume an interrupted run ({len(incomplete_runs)})"):
+        run = st.selectbox("Run", incomplete_runs, format_func=lambda r: f"{r[0].name}: {r[1]} of {r[2]} videos finished")
+        if st.button("Resume"):
+            resume_dir = run[0]
+
+def toggle_review(name):
+    # Kept outside the checkboxes' own state, which Streamlit drops for the pages that aren't shown
+    selected = st.session_state["review_selected"]
+    selected.symmetric_difference_update({name})
+
+def request_finalize():
+    # The review grid is drawn further down than the submission below, so its button only leaves a note
+    st.session_state["finalize_requested"] = True
+
+captions = None
+review_run = st.session_state.get("review_run")
+finalize = st.session_state.pop("finalize_requested", False) and not rendering
+if not rendering:
+    if st.button("Generate"):
+        captions = False
+    elif st.button("Generate with Captions"):
+        captions = True
+
+if captions is not None or resume_dir is not None or finalize:
+    if resume_dir is None and not finalize:
+        if not prefix: st.error("Enter a prefix"); st.stop()
+        if not hook_records or not voice_records: st.error("Upload at least one hook and voice"); st.stop()
+    if not profiles and (finalize or resume_dir is None and not draft): st.error("Select at least one output profile"); st.stop()
+
+    if finalize:
+        # Same inputs and trims as the drafts; their transcripts are already cached
+        try:
+            # The draft folder may have been deleted since (e.g. pruned by another session's run)
+            plan = JobJournal.load(review_run)[0]
+            if plan is None:
+                raise ValueError(f"No plan in {review_run}")
+            captions = plan["captions"]
+            batch = prepare_from_draft(
+                review_run, st.session_state["review_selected"], single_pass=single_pass, threads=threads_per_job,
+                stream_copy=stream_copy, cache=cache, transcriber=get_transcriber() if captions else None,
+                workspace=get_workspace(), profiles=profiles,
+            )
+        except (OSError, ValueError) as e:
+            for key in ("review_run", "review_videos", "review_selected"):
+                st.session_state.pop(key, None)
+            st.error(f"Can't render the selected drafts: {e}"); st.stop()
+    elif resume_dir is not None:
+        # Finished outputs are verified and kept; only the rest are rendered, into the same folder
+        captions = JobJournal.load(resume_dir)[0]["captions"]
+        try:
+            batch = prepare_resume(
+                resume_dir, threads=threads_per_job, cache=cache, transcriber=get_transcriber() if captions else None,
+                workspace=get_workspace(),
+            )
+        except (OSError, ValueError) as e:
+            st.error(f"Can't resume {resume_dir.name}: {e}"); st.stop()
+    else:
+        # Inputs were persisted and probed at upload time; workers read them in place
+        batch = prepare_batch(
+            hook_records, voice_records, body_records, prefix, captions,
+            single_pass=single_pass, threads=threads_per_job, stream_copy=stream_copy,
+            cache=cache, transcriber=get_transcriber() if captions else None, workspace=get_workspace(), draft=draft,
+            profiles=profiles,
+        )
+    # Keep rendered_videos within its quota, least recently used runs first
+    # (and the drafts under review)
+    keep = render_queue.active_runs() | {batch.out.resolve()} | ({Path(review_run).resolve()} if review_run else set())
+    pruned = get_workspace().prune_runs(batch.out.parent, keep=keep)
+    st.session_state["pruned_runs"] = [d.name for d in pruned]
+    # Rendering happens on the shared queue's workers; this script only polls it from here on
+    st.session_state["render_ticket"] = render_queue.submit(st.session_state["session_id"], batch, batch.out.name)
+    st.session_state["render_collected"] = False
+    st.session_state["cache_stats_before"] = cache.stats()
+    st.rerun()
+
+if rendering:
+    st.progress(ticket.progress, text=f"Rendering {ticket.label}: {len(ticket.results)} of {ticket.total} hook × voice pairs done")
+    queue_status = render_queue.status()
+    st.caption(f"Render queue: {queue_status['running']} of {render_queue.workers} workers busy, "
+               f"{queue_status['queued']} pairs waiting across {queue_status['batches']} batches")
+    for r in ticket.sorted_results():
+        st.write(r["label"])
+    if ticket.cancelled:
+        st.info("Cancelling: stopping the renders in progress...")
+    elif st.button("Cancel"):
+        ticket.cancel()
+        st.rerun()
+elif ticket is not None and not st.session_state.get("render_collected"):
+    # The first rerun after the batch finished reports on it, as the blocking render used to
+    st.session_state["render_collected"] = True
+    results = ticket.sorted_results()
+    out = ticket.batch.out
+    stats_before, stats_after = st.session_state["cache_stats_before"], cache.stats()
+
+    exported_videos = [p for r in results for p in r["outputs"]]
+    for r in results:
+        for e in r["errors"]:
+            st.error(f"Error: {e}")
+    if ticket.batch.draft:
+        # Reviewed above; the downloads below stay those of the last full-quality run
+        st.session_state["review_run"] = str(out)
+        st.session_state["review_videos"] = exported_videos
+        st.session_state["review_selected"] = set()
+        if ticket.cancelled:
+            st.warning(f"Cancelled. {len(exported_videos)} finished drafts can be reviewed, and the rest can be resumed.")
+        else:
+            st.success("Drafts are ready: select the videos to render at full quality.")
+    elif ticket.cancelled:
+        st.session_state["exported_videos"] = exported_videos
+        st.warning(f"Cancelled. {len(exported_videos)} finished videos are kept below, and the rest can be resumed.")
+    else:
+        st.session_state["exported_videos"] = exported_videos
+        st.success("Done! Your captioned videos are ready to download below." if ticket.batch.captions else "Done! Your videos are ready to download below.")
+    st.caption(f"Intermediate cache: {stats_after['hits'] - stats_before['hits']} hits, "
+               f"{stats_after['misses'] - stats_before['misses']} misses while this run rendered")
+    if st.session_state.get("pruned_runs"):
+        st.caption(f"Deleted the least recently used runs to stay within the rendered_videos quota: {', '.join(st.session_state['pruned_runs'])}")
+    # Every ffmpeg run (and transcription) of this run folder, from its metrics.jsonl
+    stage_totals, slowest = summarize_stages(StageLog.load(out))
+    if stage_totals:
+        with st.expander("Stage timings"):
+            st.write("Totals per stage")
+            st.dataframe([{
+                "stage": t["stage"], "runs": t["runs"], "wall s": round(t["wall"], 2), "cpu s": round(t["cpu"], 2),
+                "peak RSS MB": round(t["max_rss_mb"]), "in MB": round(t["in_mb"], 1), "out MB": round(t["out_mb"], 1),
+                "avg speed": f"{t['avg_speed']:.1f}x" if t["avg_speed"] else "",
+            } for t in stage_totals], hide_index=True)
+            st.write("Slowest stages")
+            st.dataframe([{
+                "stage": r["stage"], "output": r["output"], "wall s": round(r["wall"], 2), "cpu s": round(r["cpu"], 2),
+                "peak RSS MB": round(r["max_rss"] / 1024**2), "speed": f"{r['speed']:.1f}x" if r["speed"] else "",
+            } for r in slowest], hide_index=True)
+
+    short_hook_warnings = [w for r in results for w in r["warnings"]]
     if short_hook_warnings:
         for w in short_hook_warnings:
             st.warning(w)
 
-    processing = False
-    st.session_state["generate_pressed"] = True
-elif st.button("Generate with Captions"):
-    processing = True
-    if not prefix: st.error("Enter a prefix"); st.stop()
-    if not hooks or not voices: st.error("Upload at least one hook and voice"); st.stop()
-
-    tmp = Path(tempfile.mkdtemp())
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    out = Path("rendered_videos") / f"{prefix}_captions_{timestamp}"
-    out.mkdir(parents=True, exist_ok=True)
-    total = len(hooks) * len(voices) * max(1, len(bodies))
-    progress = st.progress(0)
-    idx = 0
-    exported_videos = []
-    short_hook_warnings = []
-    model = whisper.load_model("base")
-
-    # Standardize video/audio properties for concat compatibility
-    standard_args = ["-vf", "scale=1080:1920", "-r", "30", "-ar", "44100", "-ac", "2"]
-
-    for h in hooks:
-        h_sanitized = sanitize_filename(h.name)
-        h_path = tmp / h_sanitized
-        with open(h_path, "wb") as f: f.write(h.getbuffer())
-        for v_idx, v in enumerate(voices):
-            idx += 1
-            progress.progress(idx/total)
-            v_sanitized = sanitize_filename(v.name)
-            st.write(f"{h_sanitized} + {v_sanitized} (with captions)")
-            trimmed, dur = trimmed_voices[v_idx]
-            v_path = Path(tempfile.gettempdir()) / v_sanitized
-            try:
-                hook_dur = get_duration(h_path)
-                if hook_dur < dur:
-                    short_hook_warnings.append(f"Warning: Hook video '{h_sanitized}' ({hook_dur:.2f}s) is shorter than trimmed audio '{v_sanitized}' ({dur:.2f}s). Video will be padded to match audio.")
-                if get_duration(h_path) < dur: continue
-
-                h_cut = tmp / f"{h_path.stem}_cut.mp4"
-                ff(["ffmpeg","-y","-i",str(h_path),"-t",str(dur),"-c:v","libx264","-preset","veryfast","-c:a","aac",str(h_cut)])
-                h_vo = tmp / f"{h_path.stem}_{v_path.stem}_ov.mp4"
-                ff(["ffmpeg","-y","-i",str(h_cut),"-i",str(trimmed),"-c:v","copy","-map","0:v","-map","1:a","-shortest",str(h_vo)])
-
-                # Transcribe trimmed audio with Whisper
-                result = model.transcribe(str(trimmed), word_timestamps=False)
-                srt_path = tmp / f"{h_path.stem}_{v_path.stem}.srt"
-                write_srt(result['segments'], srt_path)
-
-                # Dynamically set font size, outline, and y-position for captions
-                video_h = get_video_height(h_vo)
-                font_size = int(video_h * 0.05)
-                stroke_width = int(video_h * 0.003)
-                margin_v = int(video_h - (0.85 * video_h))  # ffmpeg MarginV is from bottom
-                captioned = tmp / f"{h_path.stem}_{v_path.stem}_captioned.mp4"
-                ff([
-                    "ffmpeg", "-y", "-i", str(h_vo),
-                    "-vf", f"subtitles='{srt_path}':force_style='Fontname=Arial,Fontsize={font_size},PrimaryColour=&HFFFFFF&,OutlineColour=&H000000&,BorderStyle=1,Outline={stroke_width},Shadow=0,Alignment=2,Bold=1,MarginV={margin_v}'",
-                    "-c:a", "copy", str(captioned)
-                ])
-
-                if bodies:
-                    for b in bodies:
-                        b_sanitized = sanitize_filename(b.name)
-                        if "." in b_sanitized:
-                            base, ext = b_sanitized.rsplit(".", 1)
-                            b_sanitized = f"{base}.{ext.lower()}"
-                        b_path = tmp / b_sanitized
-                        with open(b_path, "wb") as f: f.write(b.getbuffer())
-                        h_vo_reenc = tmp / f"{captioned.stem}_reenc.mp4"
-                        ff([
-                            "ffmpeg", "-y", "-i", str(captioned),
-                            *standard_args,
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", str(h_vo_reenc)
-                        ])
-                        body_reenc = tmp / f"{b_path.stem}_reenc.mp4"
-                        ff([
-                            "ffmpeg", "-y", "-i", str(b_path),
-                            *standard_args,
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", str(body_reenc)
-                        ])
-                        prefix_sanitized = sanitize_filename(prefix)
-                        concat_out = tmp / f"{prefix_sanitized}_{h_sanitized}_{v_sanitized}_{b_sanitized}_captioned_concat.mp4"
-                        ff([
-                            "ffmpeg", "-y",
-                            "-i", str(h_vo_reenc),
-                            "-i", str(body_reenc),
-                            "-filter_complex", "[0:v][0:a][1:v][1:a]concat=n=2:v=1:a=1[v][a]",
-                            "-map", "[v]", "-map", "[a]",
-                            "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac",
-                            str(concat_out)
-                        ])
-                        try:
-                            clean_name = sanitize_filename(f"{prefix_sanitized}_{h_sanitized}_{v_sanitized}_{b_sanitized}_captioned") + ".mp4"
-                        except Exception:
-                            clean_name = f"output_{idx}_captioned.mp4"
-                        final = out / clean_name
-                        shutil.copy(concat_out, final)
-                        if final.exists():
-                            exported_videos.append(str(final.resolve()))
-                        else:
-                            st.error(f"Failed to generate video: {final}")
-                else:
-                    try:
-                        clean_name = sanitize_filename(f"{sanitize_filename(prefix)}_{h_sanitized}_{v_sanitized}_captioned") + ".mp4"
-                    except Exception:
-                        clean_name = f"output_{idx}_captioned.mp4"
-                    final = out / clean_name
-                    shutil.copy(captioned, final)
-                    if final.exists():
-                        exported_videos.append(str(final.resolve()))
-                    else:
-                        st.error(f"Failed to generate video: {final}")
-            except Exception as e:
-                st.error(f"Error: {e}")
-    st.session_state["exported_videos"] = exported_videos
-    st.success(f"Done! Your captioned videos are ready to download below.")
-    if short_hook_warnings:
-        for w in short_hook_warnings:
-            st.warning(w)
-    processing = False
-    st.session_state["generate_pressed"] = True
+    st.session_state["generate_pressed"] = not ticket.batch.draft
 else:
     st.session_state["generate_pressed"] = False
 
+if not rendering and st.session_state.get("review_videos"):
+    # Drafts of the whole matrix; the selected ones are rendered again at full quality
+    review_videos = [Path(p) for p in st.session_state["review_videos"] if Path(p).exists()]
+    review_selected = st.session_state["review_selected"]
+    st.markdown(f"### Review drafts ({len(review_videos)}):")
+    per_page = 12
+    pages = max(1, -(-len(review_videos) // per_page))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+    cols = st.columns(3)
+    for i, video_path in enumerate(review_videos[(page - 1) * per_page:page * per_page]):
+        with cols[i % 3]:
+            st.video(str(video_path))
+            st.checkbox(video_path.name, value=video_path.name in review_selected, key=f"review_{video_path.name}",
+                        on_change=toggle_review, args=(video_path.name,))
+    st.button(f"Render selected at full quality ({len(review_selected)})", disabled=not review_selected,
+              on_click=request_finalize)
+
 # After processing, always show download buttons if videos exist
 st.markdown("### Download your videos:")
 
-if processing:
-    with st.spinner("Processing videos, please wait..."):
-        pass
+if rendering:
+    st.info("Your videos will be listed here when the render finishes.")
 elif st.session_state["exported_videos"]:
-    st.info("Click the download icon next to each video to download it. They will be saved to your browser's default downloads folder.")
+    st.info("Click the download link next to each video to download it. They will be saved to your browser's default downloads folder.")
     for i, video_path in enumerate(st.session_state["exported_videos"]):
         video_path = Path(video_path)
         if video_path.exists():
@@ -406,33 +432,28 @@ elif st.session_state["exported_videos"]:
             with cols[1]:
                 st.markdown(f"**{video_path.name}**")
             with cols[2]:
-                with open(video_path, "rb") as video_file:
-                    st.download_button(
-                        label="Download",
-                        data=video_file.read(),
-                        file_name=video_path.name,
-                        mime="video/mp4",
-                        key=f"download_{i}"
-                    )
+                download_link(video_path, key=f"download_{i}")
         else:
             st.error(f"File not found: {video_path}")
-    # Download all as ZIP
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w") as zipf:
-        for video_path in st.session_state["exported_videos"]:
-            video_path = Path(video_path)
-            if video_path.exists():
-                zipf.write(video_path, arcname=video_path.name)
-    zip_buffer.seek(0)
-    st.download_button(
-        label="Download All Videos as ZIP",
-        data=zip_buffer,
-        file_name="all_videos.zip",
-        mime="application/zip",
-        key="download_zip"
-    )
+    # Download all as ZIP, written to disk once per run and only when asked for
+    run_dir = Path(st.session_state["exported_videos"][0]).parent
+    if st.session_state.get("zip_run") != str(run_dir):
+        if st.button("Prepare ZIP of all videos"):
+            with st.spinner("Writing ZIP..."):
+                build_zip_parts(st.session_state["exported_videos"], run_dir)
+            st.session_state["zip_run"] = str(run_dir)
+            st.rerun()
+    else:
+        zip_parts = build_zip_parts(st.session_state["exported_videos"], run_dir)
+        for i, zip_path in enumerate(zip_parts):
+            label = "Download All Videos as ZIP" if len(zip_parts) == 1 else f"Download All Videos as ZIP (part {i + 1} of {len(zip_parts)})"
+            download_link(zip_path, key=f"download_zip_{i}", label=label, mime="application/zip")
 elif st.session_state.get("generate_pressed", False):
     st.warning("No videos were generated. Please check your inputs and try again.")
 else:
     st.info("Upload your files and click Generate to create videos.")
 
+if rendering:
+    # Poll the queue; every rerun is cheap because uploads, probes and trims are cached
+    time.sleep(1)
+    st.rerun()